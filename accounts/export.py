@@ -0,0 +1,92 @@
+import zlib
+from json.encoder import encode_basestring
+
+from accounts.models import FriendShip
+from tweets.models import Like, Tweet
+
+EXPORT_CHUNK_SIZE = 2000
+# この大きさまで行をまとめてから書き出す(gzip の場合は圧縮前の大きさ)
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+
+# 1 行ごとに json.dumps を呼ぶと遅いので、文字列以外の値はそのまま埋め込んで行を組み立てる
+def _tweets(user, after):
+    rows = Tweet.objects.filter(user=user, id__gt=after).order_by("id")
+    values = rows.values_list("id", "content", "created_at", "likes_count")
+    for id, content, created_at, likes_count in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield (
+            f'{{"type":"tweet","id":{id},"content":{encode_basestring(content)},'
+            f'"created_at":"{created_at.isoformat()}","likes_count":{likes_count}}}\n'
+        )
+
+
+def _likes(user, after):
+    rows = Like.objects.filter(likeuser=user, id__gt=after).order_by("id")
+    for id, tweet_id in rows.values_list("id", "likedtweet_id").iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield f'{{"type":"like","id":{id},"tweet_id":{tweet_id}}}\n'
+
+
+def _follows(kind, owner_field, user_field):
+    def rows(user, after):
+        friendships = FriendShip.objects.filter(**{owner_field: user}, id__gt=after).order_by("id")
+        values = friendships.values_list("id", f"{user_field}_id", f"{user_field}__username", "created_at")
+        for id, user_id, username, created_at in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield (
+                f'{{"type":"{kind}","id":{id},"user_id":{user_id},"username":{encode_basestring(username)},'
+                f'"created_at":"{created_at.isoformat()}"}}\n'
+            )
+
+    return rows
+
+
+# 書き出す順番。再開用のカーソルは「種類:id」で、その行の次から書き出す
+SECTIONS = (
+    ("tweet", _tweets),
+    ("like", _likes),
+    ("following", _follows("following", "follower", "followee")),
+    ("follower", _follows("follower", "followee", "follower")),
+)
+
+
+def parse_cursor(cursor):
+    if not cursor:
+        return SECTIONS[0][0], 0
+    kind, _, id = cursor.partition(":")
+    if kind not in dict(SECTIONS) or not id.isdigit():
+        raise ValueError("不正なカーソルです。")
+    return kind, int(id)
+
+
+def export_lines(user, cursor=None):
+    """
+    ユーザーのツイート・いいね・フォロー・フォロワーを 1 行 1 件の JSON で順に返す。
+    各行の type と id をつないだ「type:id」を cursor に渡すと、その行の次から再開する。
+    """
+    kind, after = parse_cursor(cursor)
+    kinds = [name for name, _ in SECTIONS]
+    for name, rows in SECTIONS[kinds.index(kind) :]:
+        yield from rows(user, after if name == kind else 0)
+
+
+def export_chunks(user, cursor=None, compress=False):
+    """
+    export_lines を EXPORT_BUFFER_SIZE ごとのバイト列にまとめる。compress なら gzip 形式で少しずつ圧縮する。
+    """
+    # 圧縮レベル 1 でもサイズは既定値と数 % しか変わらず、書き出しの速さを保てる
+    compressor = zlib.compressobj(level=1, wbits=31) if compress else None
+    buffer = []
+    size = 0
+    for line in export_lines(user, cursor):
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            data = "".join(buffer).encode()
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = "".join(buffer).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
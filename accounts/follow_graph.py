@@ -0,0 +1,300 @@
+import bisect
+import heapq
+import logging
+import threading
+from array import array
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from accounts.models import FriendShip
+
+logger = logging.getLogger(__name__)
+
+
+class Adjacency:
+    """
+    1 方向の隣接リストを CSR (compressed sparse row) で持つ。users[i] の隣接先は
+    indices[indptr[i]:indptr[i + 1]] に昇順に並び、ユーザーは users の二分探索で引く。
+    読み込み後の追加・削除は added / removed に重ね、たまったら CSR に畳み込んで作り直す。
+    """
+
+    def __init__(self, pairs=()):
+        # pairs は (user_id, neighbour_id) の昇順
+        self.users = array("q")
+        self.indptr = array("q", [0])
+        self.indices = array("q")
+        for user_id, neighbour_id in pairs:
+            if not self.users or self.users[-1] != user_id:
+                self.users.append(user_id)
+                self.indptr.append(self.indptr[-1])
+            self.indices.append(neighbour_id)
+            self.indptr[-1] += 1
+        # 読み込み中のスレッドがいるので、集合は書き換えずに作り直して差し替える
+        self.added = {}
+        self.removed = {}
+        self.delta = 0
+        self.size = len(self.indices)
+
+    def _bounds(self, user_id):
+        i = bisect.bisect_left(self.users, user_id)
+        if i < len(self.users) and self.users[i] == user_id:
+            return self.indptr[i], self.indptr[i + 1]
+        return 0, 0
+
+    def contains(self, user_id, neighbour_id):
+        if neighbour_id in self.added.get(user_id, ()):
+            return True
+        if neighbour_id in self.removed.get(user_id, ()):
+            return False
+        start, end = self._bounds(user_id)
+        i = bisect.bisect_left(self.indices, neighbour_id, start, end)
+        return i < end and self.indices[i] == neighbour_id
+
+    @staticmethod
+    def _replace(overlay, user_id, neighbours):
+        if neighbours:
+            overlay[user_id] = neighbours
+        else:
+            overlay.pop(user_id, None)
+
+    def add(self, user_id, neighbour_id):
+        if self.contains(user_id, neighbour_id):
+            return
+        removed = self.removed.get(user_id, frozenset())
+        if neighbour_id in removed:
+            self._replace(self.removed, user_id, removed - {neighbour_id})
+        else:
+            self._replace(self.added, user_id, self.added.get(user_id, frozenset()) | {neighbour_id})
+        self.delta += 1
+        self.size += 1
+
+    def remove(self, user_id, neighbour_id):
+        if not self.contains(user_id, neighbour_id):
+            return
+        added = self.added.get(user_id, frozenset())
+        if neighbour_id in added:
+            self._replace(self.added, user_id, added - {neighbour_id})
+        else:
+            self._replace(self.removed, user_id, self.removed.get(user_id, frozenset()) | {neighbour_id})
+        self.delta += 1
+        self.size -= 1
+
+    def count(self, user_id):
+        start, end = self._bounds(user_id)
+        return end - start + len(self.added.get(user_id, ())) - len(self.removed.get(user_id, ()))
+
+    def neighbours(self, user_id, after=None):
+        # id の昇順に after より後ろの隣接先を返す
+        start, end = self._bounds(user_id)
+        if after is not None:
+            start = bisect.bisect_right(self.indices, after, start, end)
+        if user_id not in self.added and user_id not in self.removed:
+            # 重ねた変更がなければ CSR の範囲をコピーせずにそのまま返す
+            return memoryview(self.indices)[start:end]
+        removed = self.removed.get(user_id, ())
+        added = sorted(v for v in self.added.get(user_id, ()) if after is None or v > after)
+        base = (self.indices[i] for i in range(start, end))
+        return (v for v in heapq.merge(base, added) if v not in removed)
+
+    def pairs(self):
+        for user_id in sorted(set(self.users).union(self.added)):
+            for neighbour_id in self.neighbours(user_id):
+                yield user_id, neighbour_id
+
+
+def load_adjacency(reverse=False):
+    """FriendShip からフォロー先 (reverse なら フォロワー) の隣接リストを読み込む"""
+    edges = FriendShip.objects.values_list("follower_id", "followee_id").order_by("follower_id", "followee_id")
+    if reverse:
+        edges = edges.values_list("followee_id", "follower_id").order_by("followee_id", "follower_id")
+    return Adjacency(edges.iterator(chunk_size=10000))
+
+
+class FollowGraphIndex:
+    """
+    フォロー関係をフォロー先・フォロワーの 2 方向の CSR としてプロセス内に持ち、
+    判定・件数・ページの取得は DB を介さずに二分探索で答える。
+    索引はプロセスごとに持つので表示にだけ使い、フォローの重複は DB の一意制約で判定する。
+    """
+
+    # 重ねた追加・削除が CSR の辺の数のこの割合を超えたら畳み込む
+    compact_ratio = 0.125
+    compact_min = 1024
+
+    def __init__(self):
+        self._following = Adjacency()
+        self._followers = Adjacency()
+        self._lock = threading.Lock()
+        # 畳み込み中に重ねた変更 (follower_id, followee_id, followed)。畳み込んでいないときは None
+        self._changes = None
+        self._compaction = None
+
+    def load(self):
+        following = load_adjacency()
+        followers = load_adjacency(reverse=True)
+        with self._lock:
+            self._following, self._followers = following, followers
+
+    def _needs_compaction(self, adjacency):
+        return adjacency.delta > max(self.compact_min, len(adjacency.indices) * self.compact_ratio)
+
+    @staticmethod
+    def _apply(following, followers, follower_id, followee_id, followed):
+        if followed:
+            following.add(follower_id, followee_id)
+            followers.add(followee_id, follower_id)
+        else:
+            following.remove(follower_id, followee_id)
+            followers.remove(followee_id, follower_id)
+
+    def apply(self, follower_id, followee_id, followed):
+        with self._lock:
+            self._apply(self._following, self._followers, follower_id, followee_id, followed)
+            if self._changes is not None:
+                self._changes.append((follower_id, followee_id, followed))
+                return
+            if not (self._needs_compaction(self._following) or self._needs_compaction(self._followers)):
+                return
+            self._changes = []
+            # CSR の作り直しは辺の数に比例するので、リクエストを止めないよう別スレッドで行う
+            self._compaction = threading.Thread(target=self.compact, name="follow-graph-compaction", daemon=True)
+        self._compaction.start()
+
+    def add(self, follower_id, followee_id):
+        self.apply(follower_id, followee_id, True)
+
+    def remove(self, follower_id, followee_id):
+        self.apply(follower_id, followee_id, False)
+
+    def compact(self):
+        """
+        重ねた追加・削除を CSR に畳み込む。作り直している間の変更は後から重ねる。
+        add / remove は今の状態と比べて反映するので、作り直した CSR に含まれていた変更を重ねても変わらない。
+        """
+        try:
+            following = Adjacency(self._following.pairs())
+            followers = Adjacency(self._followers.pairs())
+            with self._lock:
+                for change in self._changes or []:
+                    self._apply(following, followers, *change)
+                self._following, self._followers = following, followers
+        except Exception:
+            logger.exception("フォロー関係の索引を畳み込めませんでした。")
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def is_following(self, follower_id, followee_id):
+        return self._following.contains(follower_id, followee_id)
+
+    def following_count(self, user_id):
+        return self._following.count(user_id)
+
+    def followers_count(self, user_id):
+        return self._followers.count(user_id)
+
+    def following(self, user_id, after=None, limit=20):
+        # id の昇順に after より後ろの limit 件を返す
+        return list(islice(self._following.neighbours(user_id, after), limit))
+
+    def followers(self, user_id, after=None, limit=20):
+        return list(islice(self._followers.neighbours(user_id, after), limit))
+
+    def edge_count(self):
+        return self._following.size
+
+
+_follow_graph = None
+# 読み込み中にコミットされたフォロー・アンフォロー (follower_id, followee_id, followed)。読み込んでいないときは None
+_recorded_while_loading = None
+_follow_graph_lock = threading.Lock()
+
+
+def load_follow_graph():
+    """
+    FriendShip から索引を読み込み、プロセスの索引と差し替える。読み込み中にコミットされた変更は後から重ねる。
+    """
+    global _follow_graph, _recorded_while_loading
+    with _follow_graph_lock:
+        if _recorded_while_loading is None:
+            _recorded_while_loading = []
+    follow_graph = FollowGraphIndex()
+    try:
+        follow_graph.load()
+    except Exception:
+        with _follow_graph_lock:
+            _recorded_while_loading = None
+        raise
+    with _follow_graph_lock:
+        for change in _recorded_while_loading:
+            follow_graph.apply(*change)
+        _recorded_while_loading = None
+        _follow_graph = follow_graph
+    return follow_graph
+
+
+def _load_follow_graph():
+    try:
+        load_follow_graph()
+    except Exception:
+        logger.exception("フォロー関係の索引を読み込めませんでした。")
+    finally:
+        connections.close_all()
+
+
+def start_follow_graph_loader():
+    """
+    FOLLOW_GRAPH_INDEX が有効なら、バックグラウンドで索引を読み込み始める。サーバーの起動時 (wsgi.py / asgi.py) に呼ぶ。
+    """
+    global _recorded_while_loading
+    if not getattr(settings, "FOLLOW_GRAPH_INDEX", False):
+        return
+    with _follow_graph_lock:
+        if _follow_graph is not None or _recorded_while_loading is not None:
+            return
+        _recorded_while_loading = []
+    threading.Thread(target=_load_follow_graph, name="follow-graph-loader", daemon=True).start()
+
+
+def get_follow_graph():
+    """
+    FOLLOW_GRAPH_INDEX が有効ならプロセス内の索引を返す。読み込み終わるまでは None を返すので、呼び出し側は DB で答える。
+    起動時に読み込み始めていなければここで読み込み始める。
+    索引はプロセスごとに持つので、他のプロセスでのフォローは再読み込みするまで反映されない。
+    """
+    if not getattr(settings, "FOLLOW_GRAPH_INDEX", False):
+        return None
+    follow_graph = _follow_graph
+    if follow_graph is None:
+        start_follow_graph_loader()
+    return follow_graph
+
+
+def reset_follow_graph():
+    global _follow_graph, _recorded_while_loading
+    with _follow_graph_lock:
+        _follow_graph = None
+        _recorded_while_loading = None
+
+
+def is_following(follower_id, followee_id):
+    follow_graph = get_follow_graph()
+    if follow_graph is None:
+        return FriendShip.objects.filter(follower_id=follower_id, followee_id=followee_id).exists()
+    return follow_graph.is_following(follower_id, followee_id)
+
+
+def _record(follower_id, followee_id, followed):
+    # 読み込む前の変更は読み込むときに DB から反映されるので、読み込み済みか読み込み中のときだけ記録する
+    with _follow_graph_lock:
+        follow_graph = _follow_graph
+        if _recorded_while_loading is not None:
+            _recorded_while_loading.append((follower_id, followee_id, followed))
+    if follow_graph is not None:
+        follow_graph.apply(follower_id, followee_id, followed)
+
+
+def record_follow(follower_id, followee_id, followed):
+    transaction.on_commit(lambda: _record(follower_id, followee_id, followed))
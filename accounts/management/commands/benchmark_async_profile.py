@@ -0,0 +1,86 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.urls import reverse
+
+from accounts.views import AsyncUserProfileView, UserProfileView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "プロフィールページを sync 版 (WSGI のスレッド) と async 版 (ASGI のイベントループ) で比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--viewer", help="閲覧するユーザー。省略すると username 本人")
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--query-delay-ms", type=float, default=0, help="ネットワーク越しの DB を想定して各クエリに足す待ち時間"
+        )
+
+    def handle(self, *args, username, viewer, requests, concurrency, query_delay_ms, **options):
+        try:
+            viewer = User.objects.get(username=viewer or username)
+        except User.DoesNotExist:
+            raise CommandError("ユーザーが存在しません。")
+        if query_delay_ms:
+            self.add_query_delay(query_delay_ms / 1000)
+        url = reverse("accounts:user_profile", kwargs={"username": username})
+        factory = RequestFactory()
+
+        def sync_request():
+            request = factory.get(url)
+            request.user = viewer
+            start = time.perf_counter()
+            UserProfileView.as_view()(request, username=username).render()
+            return time.perf_counter() - start
+
+        async def async_request(semaphore):
+            request = factory.get(url)
+            request.user = viewer
+            async with semaphore:
+                start = time.perf_counter()
+                await AsyncUserProfileView.as_view()(request, username=username)
+                return time.perf_counter() - start
+
+        async def run_async(concurrency):
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(async_request(semaphore) for _ in range(requests)))
+
+        def run_sync(concurrency):
+            with ThreadPoolExecutor(concurrency) as executor:
+                return list(executor.map(lambda _: sync_request(), range(requests)))
+
+        sync_request()
+        asyncio.run(run_async(1))
+        self.stdout.write(f"{'mode':<12} {'concurrency':>11} {'mean ms':>9} {'p95 ms':>9} {'req/s':>9}")
+        for level in sorted({1, concurrency}):
+            for mode, run in (("wsgi/sync", run_sync), ("asgi/async", lambda c: asyncio.run(run_async(c)))):
+                start = time.perf_counter()
+                latencies = run(level)
+                elapsed = time.perf_counter() - start
+                mean = statistics.mean(latencies) * 1000
+                p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000
+                self.stdout.write(f"{mode:<12} {level:>11} {mean:>9.2f} {p95:>9.2f} {requests / elapsed:>9.1f}")
+
+    def add_query_delay(self, delay):
+        def wrapper(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            if wrapper not in connection.execute_wrappers:
+                connection.execute_wrappers.append(wrapper)
+
+        connection_created.connect(install, weak=False)
+        for connection in connections.all():
+            install(None, connection)
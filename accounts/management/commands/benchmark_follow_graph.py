@@ -0,0 +1,91 @@
+import gc
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.follow_graph import FollowGraphIndex
+from accounts.models import FriendShip
+
+User = get_user_model()
+
+
+def measure(func, samples):
+    start = time.perf_counter()
+    for args in samples:
+        func(*args)
+    return (time.perf_counter() - start) / len(samples) * 1e6
+
+
+class Command(BaseCommand):
+    help = "フォロー関係の判定・件数・ページ取得を ORM と FollowGraphIndex で比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, samples, seed, **options):
+        user_ids = list(User.objects.values_list("id", flat=True))
+        if not user_ids:
+            self.stdout.write("ユーザーがいません。")
+            return
+        rng = random.Random(seed)
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(samples)]
+        users = [(user_id,) for user_id, _ in pairs]
+
+        start = time.perf_counter()
+        follow_graph = FollowGraphIndex()
+        follow_graph.load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        # 配列の中身だけでなくオブジェクトのヘッダーも含めて、読み込んだ後に残っているメモリを測る
+        del follow_graph
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            follow_graph = FollowGraphIndex()
+            follow_graph.load()
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+        friendships = FriendShip.objects.all()
+        operations = [
+            (
+                "is_following",
+                lambda a, b: friendships.filter(follower_id=a, followee_id=b).exists(),
+                follow_graph.is_following,
+                pairs,
+            ),
+            (
+                "followers_count",
+                lambda a: friendships.filter(followee_id=a).count(),
+                follow_graph.followers_count,
+                users,
+            ),
+            (
+                "following_page",
+                lambda a: list(
+                    friendships.filter(follower_id=a)
+                    .order_by("followee_id")
+                    .values_list("followee_id", flat=True)[:20]
+                ),
+                follow_graph.following,
+                users,
+            ),
+        ]
+        self.stdout.write(f"{'operation':<16} {'orm us/op':>12} {'index us/op':>12} {'speedup':>9}")
+        for name, orm, index, operation_samples in operations:
+            orm_us = measure(orm, operation_samples)
+            index_us = measure(index, operation_samples)
+            self.stdout.write(f"{name:<16} {orm_us:>12.2f} {index_us:>12.2f} {orm_us / index_us:>8.1f}x")
+
+        edges = follow_graph.edge_count()
+        per_edge = retained / edges if edges else 0
+        self.stdout.write(
+            f"load: {load_ms:.1f} ms, edges: {edges}, memory: {retained} bytes ({per_edge:.1f} bytes/edge)"
+        )
@@ -0,0 +1,38 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.export import export_chunks, parse_cursor
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "ユーザーのツイート・いいね・フォロー関係を JSONL で書き出す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--output", help="省略すると標準出力に書き出す")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--cursor", help="前回最後に書き出した行の「type:id」")
+
+    def handle(self, *args, username, output, gzip, cursor, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"ユーザー {username} は存在しません。")
+        try:
+            parse_cursor(cursor)
+        except ValueError as e:
+            raise CommandError(str(e))
+        # 再開するときは既存のファイルに追記する。gzip は複数メンバーを連結しても展開できる
+        stream = open(output, "ab" if cursor else "wb") if output else sys.stdout.buffer
+        try:
+            for chunk in export_chunks(user, cursor, compress=gzip):
+                stream.write(chunk)
+        finally:
+            if output:
+                stream.close()
+            else:
+                stream.flush()
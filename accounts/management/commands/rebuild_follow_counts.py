@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import FriendShip, UserProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "FriendShip テーブルから UserProfile のフォロー数・フォロワー数を再計算する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+
+    def handle(self, *args, chunk_size, **options):
+        followers = FriendShip.objects.filter(followee=OuterRef("user")).values("followee").annotate(c=Count("pk"))
+        following = FriendShip.objects.filter(follower=OuterRef("user")).values("follower").annotate(c=Count("pk"))
+        last_id = User.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        fixed = 0
+        for start in range(0, last_id + 1, chunk_size):
+            with transaction.atomic():
+                users = User.objects.filter(id__gte=start, id__lt=start + chunk_size, userprofile__isnull=True)
+                UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+                drifted = (
+                    UserProfile.objects.filter(user_id__gte=start, user_id__lt=start + chunk_size)
+                    .annotate(
+                        actual_followers=Coalesce(Subquery(followers.values("c")), 0),
+                        actual_following=Coalesce(Subquery(following.values("c")), 0),
+                    )
+                    .filter(~Q(followers_count=F("actual_followers")) | ~Q(following_count=F("actual_following")))
+                    .only("id")
+                )
+                profiles = [
+                    UserProfile(
+                        id=profile.id,
+                        followers_count=profile.actual_followers,
+                        following_count=profile.actual_following,
+                    )
+                    for profile in drifted
+                ]
+                UserProfile.objects.bulk_update(profiles, ["followers_count", "following_count"])
+                fixed += len(profiles)
+        self.stdout.write(self.style.SUCCESS(f"{fixed} 人のフォロー数を修正しました。"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from accounts.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = "フォロー関係から全ユーザーのおすすめユーザーを計算し直す"
+
+    def handle(self, *args, **options):
+        created = rebuild_recommendations()
+        self.stdout.write(self.style.SUCCESS(f"{created} 件のおすすめを作成しました。"))
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    UserProfile = apps.get_model("accounts", "UserProfile")
+    FriendShip = apps.get_model("accounts", "FriendShip")
+    missing = User.objects.filter(userprofile__isnull=True)
+    UserProfile.objects.bulk_create([UserProfile(user=user) for user in missing])
+    followers = FriendShip.objects.filter(followee=OuterRef("user")).values("followee").annotate(c=Count("pk"))
+    following = FriendShip.objects.filter(follower=OuterRef("user")).values("follower").annotate(c=Count("pk"))
+    UserProfile.objects.update(
+        followers_count=Coalesce(Subquery(followers.values("c")), 0),
+        following_count=Coalesce(Subquery(following.values("c")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0003_friendship_unique_following_followee"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="followers_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -9,6 +9,8 @@ class User(AbstractUser):
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     following = models.ManyToManyField(User, related_name="user_followers", blank=True)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -25,3 +27,17 @@ class FriendShip(models.Model):
     class Meta:
         ordering = ["-created_at"]
         constraints = [models.UniqueConstraint(fields=["follower", "followee"], name="unique_following_followee")]
+        indexes = [
+            models.Index(fields=["followee", "-created_at", "-id"], name="follow_followee_created_idx"),
+            models.Index(fields=["follower", "-created_at", "-id"], name="follow_follower_created_idx"),
+        ]
+
+
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, related_name="recommendations", on_delete=models.CASCADE)
+    candidate = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "candidate"], name="unique_recommendation")]
+        indexes = [models.Index(fields=["user", "-score", "candidate"], name="recommendation_user_score_idx")]
@@ -0,0 +1,151 @@
+import heapq
+from array import array
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from accounts.follow_graph import load_adjacency
+from accounts.models import FriendShip, Recommendation, UserProfile
+
+RECOMMENDATION_BATCH_SIZE = 1000
+
+
+def recommendations_per_user():
+    return getattr(settings, "RECOMMENDATIONS_PER_USER", 20)
+
+
+def fanout_follower_threshold():
+    return getattr(settings, "RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD", 1000)
+
+
+def friends_of_friends(following, user_id):
+    # following はフォロー先の隣接リスト。フォロー先のフォロー先ごとに、何人のフォロー先がフォローしているかを数える
+    followees = following.neighbours(user_id)
+    scores = defaultdict(int)
+    for followee in followees:
+        for candidate in following.neighbours(followee):
+            scores[candidate] += 1
+    scores.pop(user_id, None)
+    for followee in followees:
+        scores.pop(followee, None)
+    return scores
+
+
+def top_candidates(scores, limit=None):
+    # スコアの高い順、同点なら id の小さい順
+    limit = recommendations_per_user() if limit is None else limit
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def rebuild_recommendations():
+    """
+    全ユーザーのおすすめをまとめて計算し直し、Recommendation を入れ替える。
+    SQLite では書き込みのロックがデータベース全体にかかるので、計算はトランザクションの前に済ませ、
+    ロックを持つのは古い行の削除と新しい行の挿入の間だけにする。計算した行は整数配列に詰めて持つ。
+    """
+    following = load_adjacency()
+    limit = recommendations_per_user()
+    user_ids, candidate_ids, scores = array("q"), array("q"), array("q")
+    # 誰もフォローしていないユーザーにはおすすめがないので、フォローしているユーザーだけを回る
+    for user_id in following.users:
+        for candidate_id, score in top_candidates(friends_of_friends(following, user_id), limit):
+            user_ids.append(user_id)
+            candidate_ids.append(candidate_id)
+            scores.append(score)
+    recommendations = (
+        Recommendation(user_id=user_id, candidate_id=candidate_id, score=score)
+        for user_id, candidate_id, score in zip(user_ids, candidate_ids, scores)
+    )
+    with transaction.atomic():
+        Recommendation.objects.all().delete()
+        for batch in iter(lambda: list(islice(recommendations, RECOMMENDATION_BATCH_SIZE)), []):
+            Recommendation.objects.bulk_create(batch)
+    return len(user_ids)
+
+
+def _refreshes(user_id):
+    """
+    フォロー先のフォロー先まで読む行数が RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD 以下か。
+    超えるユーザーのおすすめはリクエスト中に作り直さず、定期的な rebuild_recommendations に任せる
+    """
+    limit = fanout_follower_threshold()
+    following_count = UserProfile.objects.filter(user_id=user_id).values_list("following_count", flat=True).first()
+    if following_count is not None and following_count > limit:
+        return False
+    followees = FriendShip.objects.filter(follower_id=user_id).values("followee_id")
+    reads = UserProfile.objects.filter(user_id__in=followees).aggregate(total=Sum("following_count"))["total"]
+    return (following_count or 0) + (reads or 0) <= limit
+
+
+def refresh_recommendations(user_id):
+    if not _refreshes(user_id):
+        return
+    following = list(FriendShip.objects.filter(follower_id=user_id).values_list("followee_id", flat=True))
+    scores = defaultdict(int)
+    for candidate in FriendShip.objects.filter(follower_id__in=following).values_list("followee_id", flat=True):
+        scores[candidate] += 1
+    scores.pop(user_id, None)
+    for followee in following:
+        scores.pop(followee, None)
+    recommendations = [
+        Recommendation(user_id=user_id, candidate_id=candidate, score=score)
+        for candidate, score in top_candidates(scores)
+    ]
+    Recommendation.objects.filter(user_id=user_id).delete()
+    Recommendation.objects.bulk_create(recommendations)
+
+
+def _fans_out(user_id):
+    # フォロワーの多いユーザーのフォローはリクエスト中に全員分を書き換えず、定期的な rebuild_recommendations に任せる
+    limit = fanout_follower_threshold()
+    return not UserProfile.objects.filter(user_id=user_id, followers_count__gt=limit).exists()
+
+
+def apply_follow(follower_id, followee_id):
+    """
+    follower が followee をフォローしたとき、follower 自身のおすすめを作り直し、
+    follower のフォロワーから見た followee のスコアを 1 増やす。
+    上位件数から外れていた組は 1 から数え直すことになるが、定期的な rebuild_recommendations で正しい値に戻る。
+    新しい組は RECOMMENDATIONS_PER_USER 件に満たないユーザーにだけ足す。
+    """
+    refresh_recommendations(follower_id)
+    if not _fans_out(follower_id):
+        return
+    user_ids = set(FriendShip.objects.filter(followee_id=follower_id).values_list("follower_id", flat=True))
+    user_ids -= set(
+        FriendShip.objects.filter(follower_id__in=user_ids, followee_id=followee_id).values_list(
+            "follower_id", flat=True
+        )
+    )
+    user_ids.discard(followee_id)
+    existing = Recommendation.objects.filter(user_id__in=user_ids, candidate_id=followee_id)
+    existing_ids = set(existing.values_list("user_id", flat=True))
+    existing.update(score=F("score") + 1)
+    full = (
+        Recommendation.objects.filter(user_id__in=user_ids - existing_ids)
+        .values("user_id")
+        .annotate(count=Count("id"))
+        .filter(count__gte=recommendations_per_user())
+        .values_list("user_id", flat=True)
+    )
+    Recommendation.objects.bulk_create(
+        [
+            Recommendation(user_id=user_id, candidate_id=followee_id, score=1)
+            for user_id in user_ids - existing_ids - set(full)
+        ],
+        ignore_conflicts=True,
+        batch_size=RECOMMENDATION_BATCH_SIZE,
+    )
+
+
+def apply_unfollow(follower_id, followee_id):
+    refresh_recommendations(follower_id)
+    if not _fans_out(follower_id):
+        return
+    user_ids = FriendShip.objects.filter(followee_id=follower_id).values_list("follower_id", flat=True)
+    recommendations = Recommendation.objects.filter(user_id__in=user_ids, candidate_id=followee_id)
+    recommendations.filter(score__lte=1).delete()
+    recommendations.update(score=F("score") - 1)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .follow_graph import record_follow
+from .models import FriendShip, UserProfile
+from .recommendations import apply_follow, apply_unfollow
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserProfile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=FriendShip)
+def increment_follow_counts(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserProfile.objects.filter(user_id=instance.followee_id).update(followers_count=F("followers_count") + 1)
+        UserProfile.objects.filter(user_id=instance.follower_id).update(following_count=F("following_count") + 1)
+
+
+@receiver(post_delete, sender=FriendShip)
+def decrement_follow_counts(sender, instance, **kwargs):
+    UserProfile.objects.filter(user_id=instance.followee_id).update(
+        followers_count=Greatest(F("followers_count") - 1, 0)
+    )
+    UserProfile.objects.filter(user_id=instance.follower_id).update(
+        following_count=Greatest(F("following_count") - 1, 0)
+    )
+
+
+@receiver(post_save, sender=FriendShip)
+def refresh_recommendations_on_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_follow(instance.follower_id, instance.followee_id)
+
+
+@receiver(post_delete, sender=FriendShip)
+def refresh_recommendations_on_unfollow(sender, instance, **kwargs):
+    apply_unfollow(instance.follower_id, instance.followee_id)
+
+
+@receiver(post_save, sender=FriendShip)
+def add_to_follow_graph(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_follow(instance.follower_id, instance.followee_id, followed=True)
+
+
+@receiver(post_delete, sender=FriendShip)
+def remove_from_follow_graph(sender, instance, **kwargs):
+    record_follow(instance.follower_id, instance.followee_id, followed=False)
@@ -1,11 +1,30 @@
+import gzip
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import Client, TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import Http404
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from tweets.models import Tweet
+from tweets.models import Like, Tweet
 
-from .models import FriendShip
+from . import recommendations
+from .follow_graph import FollowGraphIndex, get_follow_graph, load_follow_graph, record_follow, reset_follow_graph
+from .models import FriendShip, Recommendation, UserProfile
+from .recommendations import refresh_recommendations
+from .views import AsyncUserProfileView, UserProfileView
 
 User = get_user_model()
 
@@ -246,6 +265,7 @@ class TestLogoutView(TestCase):
 
 class TestUserProfileView(TestCase):
     def setUp(self):
+        caches["likes"].clear()
         self.user = User.objects.create_user(username="testuser", password="testpassword")
         self.tweet = Tweet.objects.create(user=self.user, content="Test tweet")
 
@@ -264,6 +284,406 @@ class TestUserProfileView(TestCase):
         user_follower_in_database = FriendShip.objects.filter(follower=self.user).count()
         self.assertEqual(user_follower_in_context, user_follower_in_database)
 
+    def test_success_get_with_liked_state(self):
+        other_tweet = Tweet.objects.create(user=self.user, content="Other tweet")
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        liked = {tweet.id: tweet.is_liked for tweet in response.context["tweets"]}
+        self.assertEqual(liked, {self.tweet.id: True, other_tweet.id: False})
+
+    def test_success_get_with_follow_counts(self):
+        another_user = User.objects.create_user(username="anotheruser", password="anothertestpassword")
+        FriendShip.objects.create(follower=another_user, followee=self.user)
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.context["followers_count"], 1)
+        self.assertEqual(response.context["followings_count"], 0)
+
+    def test_success_get_without_profile(self):
+        UserProfile.objects.filter(user=self.user).delete()
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.context["followers_count"], 0)
+        self.assertEqual(response.context["followings_count"], 0)
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+
+    def test_success_get_with_etag(self):
+        another_user = User.objects.create_user(username="anotheruser", password="anothertestpassword")
+        url = reverse("accounts:user_profile", kwargs={"username": another_user.username})
+        self.client.force_login(self.user)
+        # 初回はフォームの描画で CSRF クッキーが発行され、ETag にも含まれるので 2 回目の値を使う
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(reverse("accounts:follow", kwargs={"username": another_user.username}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["is_following"])
+
+    def test_etag_is_built_from_shown_page(self):
+        tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(25)]
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # ユーザーのツイート全体ではなく、表示するページと次の 1 件だけを読む
+        [versions] = [query["sql"] for query in queries if 'FROM "tweets_tweet"' in query["sql"]]
+        self.assertIn("LIMIT 21", versions)
+        # 表示していないページのツイートが変わっても ETag は変わらない
+        Tweet.objects.filter(pk=self.tweet.pk).update(version=F("version") + 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Tweet.objects.filter(pk=tweets[-1].pk).update(version=F("version") + 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_success_get_with_cursor(self):
+        for i in range(25):
+            Tweet.objects.create(user=self.user, content=f"tweet {i}")
+        tweets_in_database = list(Tweet.objects.filter(user=self.user).order_by("-created_at", "-id"))
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["tweets"]), tweets_in_database[:20])
+        self.assertContains(response, "toggleLike = async", count=1)
+
+        next_cursor = response.context["page"].next_cursor
+        url = reverse("accounts:user_tweets", kwargs={"username": self.user.username})
+        response = self.client.get(url, {"cursor": next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["next_cursor"])
+        self.assertEqual(response.json()["html"].count("<li>"), 6)
+
+
+class TestAsyncUserProfileView(TransactionTestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.another_user = User.objects.create_user(username="anotheruser", password="anothertestpassword")
+        FriendShip.objects.create(follower=self.user, followee=self.another_user)
+        Tweet.objects.create(user=self.another_user, content="Async tweet")
+        self.view = async_to_sync(AsyncUserProfileView.as_view())
+
+    def get(self, username, user):
+        request = RequestFactory().get(reverse("accounts:user_profile", kwargs={"username": username}))
+        request.user = user
+        return self.view(request, username=username)
+
+    def test_success_get(self):
+        response = self.get("anotheruser", self.user)
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn("Async tweet", content)
+        self.assertIn("Followers: 1", content)
+        self.assertIn(reverse("accounts:unfollow", kwargs={"username": "anotheruser"}), content)
+
+    def test_success_get_without_profile(self):
+        UserProfile.objects.filter(user=self.another_user).delete()
+        response = self.get("anotheruser", self.user)
+        self.assertIn("Followers: 0", response.content.decode())
+        self.assertFalse(UserProfile.objects.filter(user=self.another_user).exists())
+
+    def test_failure_get(self):
+        self.assertEqual(self.get("anotheruser", AnonymousUser()).status_code, 302)
+        with self.assertRaises(Http404):
+            self.get("nobody", self.user)
+
+    def test_success_get_with_etag(self):
+        etag = self.get("anotheruser", self.user)["ETag"]
+        # 同期版と同じ ETag を返し、一致すれば 304 を返す
+        request = RequestFactory().get(reverse("accounts:user_profile", kwargs={"username": "anotheruser"}))
+        request.user = self.user
+        self.assertEqual(UserProfileView.as_view()(request, username="anotheruser")["ETag"], etag)
+        request = RequestFactory().get(
+            reverse("accounts:user_profile", kwargs={"username": "anotheruser"}), HTTP_IF_NONE_MATCH=etag
+        )
+        request.user = self.user
+        self.assertEqual(self.view(request, username="anotheruser").status_code, 304)
+        FriendShip.objects.filter(follower=self.user).delete()
+        self.assertEqual(self.view(request, username="anotheruser").status_code, 200)
+
+
+class TestRebuildFollowCountsCommand(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.another_user = User.objects.create_user(username="anotheruser", password="anothertestpassword")
+        FriendShip.objects.create(follower=self.user, followee=self.another_user)
+
+    def test_rebuild(self):
+        UserProfile.objects.update(followers_count=7, following_count=7)
+        UserProfile.objects.filter(user=self.another_user).delete()
+        call_command("rebuild_follow_counts", stdout=StringIO())
+        self.assertEqual(UserProfile.objects.get(user=self.user).followers_count, 0)
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 1)
+        self.assertEqual(UserProfile.objects.get(user=self.another_user).followers_count, 1)
+
+
+class TestRecommendation(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"user{i}", password="testpassword") for i in range(5)]
+        a, b, c, d, e = self.users
+        for follower, followee in [(a, b), (a, c), (b, d), (c, d), (c, e), (e, a), (d, b)]:
+            FriendShip.objects.create(follower=follower, followee=followee)
+
+    def recommendations(self):
+        return set(Recommendation.objects.values_list("user__username", "candidate__username", "score"))
+
+    def test_incremental_refresh_matches_rebuild(self):
+        expected = {
+            ("user0", "user3", 2),
+            ("user0", "user4", 1),
+            ("user2", "user0", 1),
+            ("user2", "user1", 1),
+            ("user4", "user1", 1),
+            ("user4", "user2", 1),
+        }
+        self.assertEqual(self.recommendations(), expected)
+        call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertEqual(self.recommendations(), expected)
+
+    def test_unfollow(self):
+        a, b, c, d, e = self.users
+        FriendShip.objects.get(follower=c, followee=d).delete()
+        self.assertIn(("user0", "user3", 1), self.recommendations())
+        self.assertNotIn(("user2", "user1", 1), self.recommendations())
+        FriendShip.objects.get(follower=b, followee=d).delete()
+        incremental = self.recommendations()
+        call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertEqual(incremental, self.recommendations())
+
+    @override_settings(RECOMMENDATIONS_PER_USER=2)
+    def test_follow_does_not_exceed_cap(self):
+        a, b, c, d, e = self.users
+        f = User.objects.create_user(username="user5", password="testpassword")
+        FriendShip.objects.create(follower=b, followee=f)
+        # user0 は既に 2 件あるので足さず、まだ無い user3 にだけ足す
+        self.assertNotIn(("user0", "user5", 1), self.recommendations())
+        self.assertIn(("user3", "user5", 1), self.recommendations())
+
+    @override_settings(RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_follow_by_popular_user_is_left_to_rebuild(self):
+        a, b, c, d, e = self.users
+        f = User.objects.create_user(username="user5", password="testpassword")
+        FriendShip.objects.create(follower=b, followee=f)
+        self.assertNotIn(("user3", "user5", 1), self.recommendations())
+        call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertIn(("user3", "user5", 1), self.recommendations())
+
+    def test_rebuild_computes_before_transaction(self):
+        depths = []
+        friends_of_friends = recommendations.friends_of_friends
+
+        def record_depth(following, user_id):
+            depths.append(len(connection.atomic_blocks))
+            return friends_of_friends(following, user_id)
+
+        outside = len(connection.atomic_blocks)
+        with mock.patch.object(recommendations, "friends_of_friends", record_depth):
+            call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertEqual(set(depths), {outside})
+
+    def test_refresh_is_left_to_rebuild_when_reads_exceed_threshold(self):
+        a = self.users[0]
+        Recommendation.objects.filter(user=a).delete()
+        # user0 のフォロー 2 件と、フォロー先 (user1, user2) のフォロー 3 件を読む
+        with override_settings(RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD=4):
+            refresh_recommendations(a.id)
+        self.assertFalse(Recommendation.objects.filter(user=a).exists())
+        with override_settings(RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD=5):
+            refresh_recommendations(a.id)
+        self.assertIn(("user0", "user3", 2), self.recommendations())
+
+    def test_profile_shows_recommendations(self):
+        self.client.force_login(self.users[0])
+        url = reverse("accounts:user_profile", kwargs={"username": "user0"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        # ETag 用の読み込みとは別に、表示用の読み込みは 1 回だけ
+        rendered = [query for query in queries if "accounts_recommendation" in query["sql"] and "JOIN" in query["sql"]]
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual([r.candidate.username for r in response.context["recommendations"]], ["user3", "user4"])
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "user1"}))
+        self.assertNotIn("recommendations", response.context)
+
+
+@override_settings(FOLLOW_GRAPH_INDEX=True)
+class TestFollowGraphIndex(TestCase):
+    def setUp(self):
+        reset_follow_graph()
+        self.users = [User.objects.create_user(username=f"user{i}", password="testpassword") for i in range(4)]
+        a, b, c, d = self.users
+        for follower, followee in [(a, b), (a, c), (a, d), (b, a), (c, a)]:
+            FriendShip.objects.create(follower=follower, followee=followee)
+        self.addCleanup(reset_follow_graph)
+
+    def test_load(self):
+        a, b, c, d = self.users
+        follow_graph = FollowGraphIndex()
+        follow_graph.load()
+        self.assertTrue(follow_graph.is_following(a.id, b.id))
+        self.assertFalse(follow_graph.is_following(b.id, c.id))
+        self.assertEqual(follow_graph.following_count(a.id), 3)
+        self.assertEqual(follow_graph.followers_count(a.id), 2)
+        self.assertEqual(follow_graph.following(a.id, limit=2), [b.id, c.id])
+        self.assertEqual(follow_graph.following(a.id, after=c.id), [d.id])
+        self.assertEqual(follow_graph.followers(d.id), [a.id])
+        self.assertEqual(follow_graph.edge_count(), 5)
+        # フォロー先の CSR: a -> b, c, d / b -> a / c -> a
+        following = follow_graph._following
+        self.assertEqual(list(following.users), [a.id, b.id, c.id])
+        self.assertEqual(list(following.indptr), [0, 3, 4, 5])
+        self.assertEqual(list(following.indices), [b.id, c.id, d.id, a.id, a.id])
+
+    def test_overlay_and_compaction(self):
+        a, b, c, d = self.users
+        follow_graph = FollowGraphIndex()
+        follow_graph.load()
+        follow_graph.add(d.id, b.id)
+        follow_graph.remove(a.id, c.id)
+        follow_graph.add(a.id, c.id)
+        follow_graph.remove(a.id, d.id)
+        self.assertEqual(follow_graph.following(a.id), [b.id, c.id])
+        self.assertEqual(follow_graph.followers(b.id, after=a.id), [d.id])
+        self.assertEqual(follow_graph.following_count(a.id), 2)
+        self.assertEqual(follow_graph.followers_count(b.id), 2)
+        self.assertEqual(follow_graph.edge_count(), 5)
+        follow_graph.compact_min = 0
+        follow_graph.add(b.id, c.id)
+        follow_graph._compaction.join()
+        self.assertEqual(follow_graph._following.delta, 0)
+        self.assertEqual(follow_graph.following(a.id), [b.id, c.id])
+        self.assertEqual(follow_graph.following(b.id), [a.id, c.id])
+        self.assertEqual(follow_graph.followers(c.id), [a.id, b.id])
+
+    def test_compaction_replays_changes_made_while_compacting(self):
+        a, b, c, d = self.users
+        follow_graph = FollowGraphIndex()
+        follow_graph.load()
+        follow_graph.compact_min = 0
+        with mock.patch("accounts.follow_graph.threading.Thread") as thread:
+            follow_graph.add(d.id, b.id)
+            follow_graph.add(d.id, c.id)
+            follow_graph.remove(d.id, b.id)
+        # 畳み込みは別スレッドで 1 回だけ始め、その間の変更は記録しておく
+        thread.assert_called_once()
+        self.assertEqual(follow_graph._changes, [(d.id, c.id, True), (d.id, b.id, False)])
+        follow_graph.compact()
+        self.assertIsNone(follow_graph._changes)
+        self.assertEqual(follow_graph._following.delta, 0)
+        self.assertEqual(follow_graph.following(d.id), [c.id])
+        self.assertEqual(follow_graph.followers(b.id), [a.id])
+        self.assertEqual(follow_graph.followers(c.id), [a.id, d.id])
+
+    def test_index_is_loaded_in_background(self):
+        a, b, c, d = self.users
+        with mock.patch("accounts.follow_graph.threading.Thread") as thread:
+            # 読み込み終わるまでは None を返し、呼び出し側は DB で答える
+            self.assertIsNone(get_follow_graph())
+            self.assertIsNone(get_follow_graph())
+        thread.assert_called_once()
+        self.client.force_login(b)
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": a.username}))
+        self.assertTrue(response.context["is_following"])
+        # 読み込み中にコミットされたフォローは、読み込みに含まれていなくても後から重ねる
+        with self.captureOnCommitCallbacks(execute=True):
+            record_follow(d.id, b.id, True)
+        follow_graph = load_follow_graph()
+        self.assertIs(get_follow_graph(), follow_graph)
+        self.assertTrue(follow_graph.is_following(d.id, b.id))
+
+    def test_follow_and_unfollow_update_index(self):
+        a, b, c, d = self.users
+        follow_graph = load_follow_graph()
+        self.client.force_login(d)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("accounts:follow", kwargs={"username": b.username}))
+        self.assertTrue(follow_graph.is_following(d.id, b.id))
+        self.assertEqual(follow_graph.followers(b.id), [a.id, d.id])
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": b.username}))
+        self.assertEqual(response.status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("accounts:unfollow", kwargs={"username": b.username}))
+        self.assertFalse(follow_graph.is_following(d.id, b.id))
+        self.assertEqual(follow_graph.followers_count(b.id), 1)
+
+    def test_follow_ignores_stale_index(self):
+        a, b, c, d = self.users
+        # 他のプロセスでアンフォローされ、このプロセスの索引にだけ残っている
+        load_follow_graph().add(d.id, b.id)
+        self.client.force_login(d)
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": b.username}))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(FriendShip.objects.filter(follower=d, followee=b).exists())
+
+    def test_profile_uses_index(self):
+        a, b, c, d = self.users
+        load_follow_graph()
+        self.client.force_login(b)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("accounts:user_profile", kwargs={"username": a.username}))
+        self.assertFalse(any("accounts_friendship" in query["sql"] for query in queries))
+        self.assertTrue(response.context["is_following"])
+        self.assertEqual(response.context["followings_count"], 3)
+        self.assertEqual(response.context["followers_count"], 2)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_follow_graph", samples=10, stdout=out)
+        self.assertIn("is_following", out.getvalue())
+        self.assertIn("bytes/edge", out.getvalue())
+
+
+class TestUserDataExport(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f'ツイート "{i}"') for i in range(3)]
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweets[0])
+        FriendShip.objects.create(follower=self.user, followee=self.other)
+        FriendShip.objects.create(follower=self.other, followee=self.user)
+        self.url = reverse("accounts:export", kwargs={"username": self.user.username})
+        self.client.force_login(self.user)
+
+    def get_rows(self, params=None):
+        response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        if params and params.get("gzip"):
+            content = gzip.decompress(content)
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_export(self):
+        rows = self.get_rows()
+        self.assertEqual([row["type"] for row in rows], ["tweet"] * 3 + ["like", "following", "follower"])
+        self.assertEqual(rows[0]["content"], 'ツイート "0"')
+        self.assertEqual(rows[3]["tweet_id"], self.tweets[0].id)
+        self.assertEqual(rows[4]["username"], "other")
+        self.assertEqual(self.get_rows({"gzip": "1"}), rows)
+
+    def test_export_with_cursor(self):
+        rows = self.get_rows()
+        resumed = self.get_rows({"cursor": f"tweet:{self.tweets[1].id}"})
+        self.assertEqual(resumed, rows[2:])
+        resumed = self.get_rows({"cursor": f"following:{rows[4]['id']}"})
+        self.assertEqual(resumed, rows[5:])
+        response = self.client.get(self.url, {"cursor": "unknown:1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_other_user_is_forbidden(self):
+        response = self.client.get(reverse("accounts:export", kwargs={"username": self.other.username}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "export.jsonl.gz"
+            call_command("export_user_data", "testuser", output=str(path), gzip=True, cursor="like:0")
+            lines = gzip.decompress(path.read_bytes()).decode().splitlines()
+        self.assertEqual([json.loads(line)["type"] for line in lines], ["like", "following", "follower"])
+
 
 # class TestUserProfileEditView(TestCase):
 #     def test_success_get(self):
@@ -292,6 +712,8 @@ class TestFollowView(TestCase):
             target_status_code=200,
         )
         self.assertTrue(FriendShip.objects.filter(follower=self.user).exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 1)
+        self.assertEqual(UserProfile.objects.get(user=self.another_user).followers_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         nonexistent_username = "nonexistentuser"
@@ -325,6 +747,8 @@ class TestUnfollowView(TestCase):
             target_status_code=200,
         )
         self.assertFalse(FriendShip.objects.filter(follower=self.user).exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 0)
+        self.assertEqual(UserProfile.objects.get(user=self.another_user).followers_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         nonexistent_username = "nonexistentuser"
@@ -353,6 +777,24 @@ class TestFollowingListView(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
 
+    def test_success_get_with_cursor(self):
+        others = [User.objects.create_user(username=f"other{i}", password="testpassword") for i in range(4)]
+        for other in others:
+            FriendShip.objects.create(follower=self.user, followee=other)
+        FriendShip.objects.create(follower=others[3], followee=self.user)
+        following = list(FriendShip.objects.filter(follower=self.user).order_by("-created_at", "-id"))
+        with mock.patch("accounts.views.FollowingListView.page_size", 3):
+            response = self.client.get(self.url)
+            self.assertEqual(list(response.context["following_list"]), following[:3])
+            row = response.context["following_list"][0]
+            self.assertTrue(row.you_follow)
+            self.assertTrue(row.follows_you)
+            self.assertFalse(response.context["following_list"][1].follows_you)
+            with self.assertNumQueries(5):
+                response = self.client.get(self.url, {"cursor": response.context["page"].next_cursor})
+        self.assertEqual(list(response.context["following_list"]), following[3:])
+        self.assertFalse(response.context["page"].has_next())
+
 
 class TestFollowerListView(TestCase):
     def setUp(self):
@@ -366,3 +808,12 @@ class TestFollowerListView(TestCase):
     def test_success_get(self):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
+
+    @override_settings(STREAMING_RESPONSES=True)
+    def test_success_get_with_streaming(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(0):
+            content = b"".join(response.streaming_content).decode()
+        self.assertIn(reverse("accounts:user_profile", kwargs={"username": "anotheruser"}), content)
@@ -1,15 +1,20 @@
+from django.conf import settings
 from django.contrib.auth import views as auth_views
 from django.urls import path
 
 from . import views
 
+UserProfileView = views.AsyncUserProfileView if settings.ASYNC_VIEWS else views.UserProfileView
+
 app_name = "accounts"
 
 urlpatterns = [
     path("signup/", views.SignupView.as_view(), name="signup"),
     path("login/", auth_views.LoginView.as_view(template_name="accounts/login.html"), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
-    path("<str:username>/", views.UserProfileView.as_view(), name="user_profile"),
+    path("<str:username>/", UserProfileView.as_view(), name="user_profile"),
+    path("<str:username>/tweets/", views.UserTweetListView.as_view(), name="user_tweets"),
+    path("<str:username>/export/", views.UserDataExportView.as_view(), name="export"),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
     path("<str:username>/following_list/", views.FollowingListView.as_view(), name="following_list"),
@@ -1,19 +1,105 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseBadRequest
-from django.shortcuts import get_object_or_404, redirect
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import CreateView, ListView, TemplateView
 
-from tweets.models import Like, Tweet
+from mysite.async_db import gather_reads
+from mysite.db_router import AsyncReplicaReadMixin, ReplicaReadMixin
+from tweets.conditional import AsyncConditionalGetMixin, ConditionalGetMixin, like_set_version
+from tweets.likes import with_liked_state
+from tweets.models import Tweet
+from tweets.pagination import CursorPaginationMixin, CursorPaginator
+from tweets.streaming import StreamingTemplateMixin
 
+from .export import export_chunks, parse_cursor
+from .follow_graph import get_follow_graph, is_following
 from .forms import SignupForm
-from .models import FriendShip
+from .models import FriendShip, Recommendation
 
 User = get_user_model()
 
+PROFILE_TWEETS_PAGE_SIZE = 20
+
+
+def get_profile_tweets(user, viewer, cursor):
+    page = CursorPaginator(PROFILE_TWEETS_PAGE_SIZE).paginate(Tweet.objects.filter(user=user), cursor)
+    page.object_list = with_liked_state(page.object_list, viewer)
+    return page
+
+
+def profile_tweet_versions(user_id, cursor):
+    """get_profile_tweets と同じページ (次のページの有無を決める 1 件を含む) の (id, version)"""
+    _, tweets = CursorPaginator(PROFILE_TWEETS_PAGE_SIZE).filter(Tweet.objects.filter(user_id=user_id), cursor)
+    return list(tweets.values_list("id", "version")[: PROFILE_TWEETS_PAGE_SIZE + 1])
+
+
+def get_profile_reads(user, viewer, cursor, recommendation_count):
+    """プロフィールページの読み込みのうち、互いに依存しないもの (ツイート・フォロー状態・おすすめ)"""
+
+    def get_recommendations():
+        if user != viewer:
+            return None
+        recommendations = Recommendation.objects.filter(user=user).select_related("candidate")
+        return list(recommendations.order_by("-score", "candidate")[:recommendation_count])
+
+    return [
+        lambda: get_profile_tweets(user, viewer, cursor),
+        lambda: is_following(viewer.id, user.id),
+        get_recommendations,
+    ]
+
+
+def profile_validator_parts(request, username, recommendation_count):
+    """UserProfileView と AsyncUserProfileView の ETag を決める値"""
+    user = User.objects.filter(username=username)
+    user = user.values_list("id", "userprofile__followers_count", "userprofile__following_count").first()
+    if user is None:
+        raise Http404("ユーザーが見つかりません。")
+    user_id = user[0]
+    cursor = request.GET.get("cursor")
+    parts = [
+        user,
+        cursor,
+        profile_tweet_versions(user_id, cursor),
+        is_following(request.user.id, user_id),
+        like_set_version(request.user.id),
+    ]
+    follow_graph = get_follow_graph()
+    if follow_graph is not None:
+        parts.append((follow_graph.following_count(user_id), follow_graph.followers_count(user_id)))
+    if user_id == request.user.id:
+        recommendations = Recommendation.objects.filter(user_id=user_id).order_by("-score", "candidate")
+        parts.append(list(recommendations.values_list("candidate_id", "score")[:recommendation_count]))
+    return parts
+
+
+def build_profile_context(user, profile, page, following, recommendations):
+    # プロフィールは post_save シグナルで作られる。まだ無いユーザー (rebuild_follow_counts の前など) は 0 件として扱う
+    context = {
+        "user": user,
+        "page": page,
+        "tweets": page.object_list,
+        "is_following": following,
+        "followings_count": profile.following_count if profile else 0,
+        "followers_count": profile.followers_count if profile else 0,
+    }
+    follow_graph = get_follow_graph()
+    if follow_graph is not None:
+        context["followings_count"] = follow_graph.following_count(user.id)
+        context["followers_count"] = follow_graph.followers_count(user.id)
+    if recommendations is not None:
+        context["recommendations"] = recommendations
+    return context
+
 
 class SignupView(CreateView):
     form_class = SignupForm
@@ -29,22 +115,72 @@ class SignupView(CreateView):
         return response
 
 
-class UserProfileView(LoginRequiredMixin, TemplateView):
+class UserProfileView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, TemplateView):
     template_name = "accounts/profile.html"
+    recommendation_count = 5
+
+    def get_validator_parts(self):
+        return profile_validator_parts(self.request, self.kwargs["username"], self.recommendation_count)
 
     def get_context_data(self, username, **kwargs):
-        user = User.objects.get(username=username)
+        user = User.objects.select_related("userprofile").get(username=username)
+        profile = getattr(user, "userprofile", None)
         context = super().get_context_data(**kwargs)
-        context["user"] = user
-        context["tweets"] = Tweet.objects.filter(user=user).order_by("-created_at")
-        follow_query = FriendShip.objects.filter(followee=user, follower=self.request.user)
-        context["is_following"] = follow_query.exists()
-        context["followings_count"] = FriendShip.objects.filter(follower=user).count()
-        context["followers_count"] = FriendShip.objects.filter(followee=user).count()
-        context["like_list"] = Like.objects.filter(likeuser=self.request.user).values_list("likedtweet__pk", flat=True)
+        reads = get_profile_reads(user, self.request.user, self.request.GET.get("cursor"), self.recommendation_count)
+        context.update(build_profile_context(user, profile, *[read() for read in reads]))
         return context
 
 
+class AsyncUserProfileView(AsyncReplicaReadMixin, AsyncConditionalGetMixin, View):
+    """
+    UserProfileView の async 版。プロフィールのユーザーを読んだ後の、ツイート・フォロー状態・おすすめの
+    読み込みを並行に実行するので、待ち時間は合計ではなく一番遅いクエリに近くなる。
+    """
+
+    template_name = "accounts/profile.html"
+    recommendation_count = 5
+
+    def get_validator_parts(self):
+        return profile_validator_parts(self.request, self.kwargs["username"], self.recommendation_count)
+
+    async def get_page(self, request, username):
+        viewer = request.user
+        user = await User.objects.select_related("userprofile").filter(username=username).afirst()
+        if user is None:
+            raise Http404("ユーザーが見つかりません。")
+        profile = getattr(user, "userprofile", None)
+        reads = get_profile_reads(user, viewer, request.GET.get("cursor"), self.recommendation_count)
+        context = await sync_to_async(build_profile_context)(user, profile, *await gather_reads(*reads))
+        return await sync_to_async(render)(request, self.template_name, context)
+
+
+class UserTweetListView(LoginRequiredMixin, ReplicaReadMixin, View):
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=self.kwargs["username"])
+        page = get_profile_tweets(user, request.user, request.GET.get("cursor"))
+        html = render_to_string("accounts/tweet_list.html", {"tweets": page.object_list}, request=request)
+        return JsonResponse({"html": html, "next_cursor": page.next_cursor})
+
+
+class UserDataExportView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=self.kwargs["username"])
+        if user != request.user and not request.user.is_staff:
+            raise PermissionDenied
+        cursor = request.GET.get("cursor")
+        try:
+            parse_cursor(cursor)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        compress = request.GET.get("gzip") == "1"
+        filename = f"{user.username}.jsonl" + (".gz" if compress else "")
+        return StreamingHttpResponse(
+            export_chunks(user, cursor, compress=compress),
+            content_type="application/gzip" if compress else "application/x-ndjson; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+
 class FollowView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         followee_name = self.kwargs["username"]
@@ -52,11 +188,12 @@ class FollowView(LoginRequiredMixin, View):
 
         if request.user == followee:
             return HttpResponseBadRequest("自分自身のユーザーをフォローすることはできません。")
-        elif FriendShip.objects.filter(follower=self.request.user, followee=followee).exists():
+        # 重複は一意制約で判定する。プロセスごとの索引は他のプロセスでのフォロー・アンフォローを知らない
+        with transaction.atomic():
+            _, created = FriendShip.objects.get_or_create(follower=request.user, followee=followee)
+        if not created:
             return HttpResponseBadRequest("既にフォローしています。")
-        else:
-            FriendShip.objects.get_or_create(follower=request.user, followee=followee)
-            return redirect("tweets:home")
+        return redirect("tweets:home")
 
 
 class UnFollowView(LoginRequiredMixin, View):
@@ -68,28 +205,61 @@ class UnFollowView(LoginRequiredMixin, View):
             return HttpResponseBadRequest("自分自身をアンフォローすることはできません")
 
         else:
-            FriendShip.objects.filter(follower=request.user, followee=followee).delete()
+            with transaction.atomic():
+                FriendShip.objects.filter(follower=request.user, followee=followee).delete()
 
         return redirect("tweets:home")
 
 
-class FollowingListView(ListView):
+def annotate_follow_state(friendships, viewer, field):
+    """
+    一覧の各行の相手 (field 側のユーザー) について、閲覧者がフォローしているか (you_follow) と
+    閲覧者をフォローしているか (follows_you) を 1 回のクエリでまとめて付ける。
+    """
+    user_ids = {getattr(friendship, f"{field}_id") for friendship in friendships}
+    edges = set()
+    if viewer.is_authenticated and user_ids:
+        edges = set(
+            FriendShip.objects.filter(
+                Q(follower=viewer, followee_id__in=user_ids) | Q(follower_id__in=user_ids, followee=viewer)
+            ).values_list("follower_id", "followee_id")
+        )
+    for friendship in friendships:
+        user_id = getattr(friendship, f"{field}_id")
+        friendship.you_follow = (viewer.id, user_id) in edges
+        friendship.follows_you = (user_id, viewer.id) in edges
+    return friendships
+
+
+class FollowListView(ReplicaReadMixin, CursorPaginationMixin, StreamingTemplateMixin, ListView):
     model = FriendShip
-    template_name = "accounts/followinglist.html"
-    context_object_name = "following_list"
+    page_size = 50
+    stream_row_context_name = "profile"
+    # 一覧に並べる相手側のフィールドと、絞り込みに使う自分側のフィールド
+    user_field = None
+    owner_field = None
 
     def get_queryset(self):
         user = get_object_or_404(User, username=self.kwargs["username"])
-        following_users = FriendShip.objects.filter(follower=user).select_related("followee")
-        return following_users
+        return FriendShip.objects.filter(**{self.owner_field: user}).select_related(self.user_field)
 
+    def paginate_by_cursor(self, queryset):
+        page = super().paginate_by_cursor(queryset)
+        page.object_list = annotate_follow_state(page.object_list, self.request.user, self.user_field)
+        return page
 
-class FollowerListView(ListView):
-    model = FriendShip
+
+class FollowingListView(FollowListView):
+    template_name = "accounts/followinglist.html"
+    context_object_name = "following_list"
+    stream_row_template_name = "accounts/following_row.html"
+    user_field = "followee"
+    owner_field = "follower"
+
+
+class FollowerListView(FollowListView):
     template_name = "accounts/followerlist.html"
     context_object_name = "follower_list"
-
-    def get_queryset(self):
-        user = get_object_or_404(User, username=self.kwargs["username"])
-        follower_users = FriendShip.objects.filter(followee=user).select_related("follower")
-        return follower_users
+    stream_row_template_name = "accounts/follower_row.html"
+    user_field = "follower"
+    owner_field = "followee"
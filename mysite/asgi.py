@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from accounts.follow_graph import start_follow_graph_loader  # noqa: E402
+from tweets.live import LIVE_PATH, live_application  # noqa: E402
+
+# フォロー関係の索引を使うなら、最初のリクエストを待たずに読み込み始める
+start_follow_graph_loader()
+
+
+async def application(scope, receive, send):
+    # Server-Sent Events の接続は Django を通さずに直接扱う
+    if scope["type"] == "http" and scope["path"] == LIVE_PATH:
+        return await live_application(scope, receive, send)
+    return await django_application(scope, receive, send)
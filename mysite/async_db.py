@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from mysite.sql_instrumentation import record_thread_queries
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all())
+
+
+def get_read_executor():
+    """
+    gather_reads が使うスレッドプール。スレッドの数は ASYNC_DB_READ_WORKERS で決まり、
+    接続はスレッドごとに持ち続けるので、同時に開く接続の数もそれ以上にはならない。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_READ_WORKERS, thread_name_prefix="db-read")
+    return _executor
+
+
+def _run_read(func):
+    try:
+        with record_thread_queries():
+            return func()
+    finally:
+        # リクエストの終わりと同じく、CONN_MAX_AGE を過ぎた接続と使えなくなった接続だけを閉じる
+        close_old_connections()
+
+
+async def gather_reads(*funcs):
+    """
+    互いに依存しない読み込み (引数なしの関数) を並行に実行し、結果を順に返す。
+    Django の async ORM は 1 本のスレッドで順に実行されるので、それぞれ get_read_executor のスレッドで実行する。
+    トランザクション中は他の接続からコミット前の行が見えないので、同じ接続で順に実行する。
+    """
+    # リクエストの接続は sync_to_async の既定のスレッドにあるので、そこで確かめる
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(func)() for func in funcs]
+    loop = asyncio.get_running_loop()
+    executor = get_read_executor()
+    # レプリカへの振り分けは ContextVar で決まるので、呼び出し元のコンテキストで実行する
+    return await asyncio.gather(
+        *(loop.run_in_executor(executor, contextvars.copy_context().run, _run_read, func) for func in funcs)
+    )
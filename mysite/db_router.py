@@ -0,0 +1,98 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA_DB_ALIAS = "replica"
+PIN_PRIMARY_COOKIE = "pin_primary"
+
+_use_replica = ContextVar("use_replica", default=False)
+
+
+def replica_available():
+    if REPLICA_DB_ALIAS not in connections.databases:
+        return False
+    # テストでは replica が default のミラーになる。同じ DB なら default の接続で読めばよい
+    return connections[REPLICA_DB_ALIAS].settings_dict["NAME"] != connections["default"].settings_dict["NAME"]
+
+
+class ReplicaRouter:
+    """
+    ReplicaReadMixin を付けたビューの読み込みだけを replica に送り、書き込みは常に default に送る。
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_available():
+            return REPLICA_DB_ALIAS
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+def reads_from_replica(request):
+    return request.method in ("GET", "HEAD") and PIN_PRIMARY_COOKIE not in request.COOKIES
+
+
+class ReplicaReadMixin:
+    def dispatch(self, request, *args, **kwargs):
+        if not reads_from_replica(request):
+            return super().dispatch(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse はビューを抜けてから評価されるので、ここで描画まで済ませる
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+            return response
+        finally:
+            _use_replica.reset(token)
+
+
+class AsyncReplicaReadMixin:
+    """
+    async なビュー用の ReplicaReadMixin。sync_to_async で実行する読み込みにもコンテキストごと引き継がれる。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not reads_from_replica(request):
+            return await super().dispatch(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+
+class ReadYourWritesMiddleware:
+    """
+    書き込みリクエストの後 READ_YOUR_WRITES_WINDOW 秒間はクッキーで default に固定し、
+    自分の書き込みがリダイレクト先ですぐ見えるようにする。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and request.user.is_authenticated:
+            response.set_cookie(
+                PIN_PRIMARY_COOKIE, "1", max_age=getattr(settings, "READ_YOUR_WRITES_WINDOW", 5), httponly=True
+            )
+        return response
+
+
+@receiver(connection_created)
+def enable_sqlite_wal(sender, connection, **kwargs):
+    # WAL にしておくと replica 側の読み込みが default の書き込みにブロックされない
+    if connection.vendor == "sqlite" and connection.alias == "default":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
@@ -43,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "mysite.sql_instrumentation.SQLInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mysite.db_router.ReadYourWritesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -80,7 +82,79 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # 同じ SQLite ファイルを読み込み専用で開く。PostgreSQL ならレプリカの接続先を書く
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        "OPTIONS": {"uri": True},
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+DATABASE_ROUTERS = ["mysite.db_router.ReplicaRouter"]
+
+# 書き込み後、この秒数の間は読み込みも default に送る
+READ_YOUR_WRITES_WINDOW = 5
+
+
+# 計測するリクエストの割合 (DEBUG のときはすべて計測する。0 なら計測しない)。計測したリクエストにはクエリ数と SQL の合計時間を
+# Server-Timing ヘッダーで付け、mysite.sql_instrumentation のロガーに記録する
+SQL_INSTRUMENTATION_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+# 1 リクエストで同じ形の SQL がこの回数を超えて実行されたら N+1 の疑いとして WARNING を出す
+SQL_N_PLUS_ONE_THRESHOLD = 10
+# manage.py test では計測しない (mysite/test_runner.py)
+TEST_RUNNER = "mysite.test_runner.TestRunner"
+
+# Logging
+# https://docs.djangoproject.com/en/4.0/topics/logging/
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "mysite.sql_instrumentation.JSONFormatter"},
+    },
+    "handlers": {
+        "sql_instrumentation": {"class": "logging.StreamHandler", "formatter": "json"},
+    },
+    "loggers": {
+        "mysite.sql_instrumentation": {"handlers": ["sql_instrumentation"], "level": "INFO", "propagate": False},
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # ユーザーごとのいいね済みツイート id。locmem は MAX_ENTRIES を超えると LRU で追い出す。
+    # locmem はプロセスごとなので、他のプロセスでのいいねは TIMEOUT 秒まで反映されない。
+    # 複数プロセスで動かすときは Redis などの共有キャッシュにすれば、いいねのたびの版の更新がすぐに全体に効く
+    "likes": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "likes",
+        "TIMEOUT": 60,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    # 閲覧者に依存しないツイートの HTML。キーに version を含めて内容が変わるたびに切り替わるので、長めに持つ。
+    # テンプレートが 3 種類あるので、1 万ツイート分を目安にする
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fragments",
+        "TIMEOUT": 86400,
+        "OPTIONS": {"MAX_ENTRIES": 30000},
+    },
+    # ConditionalGetMixin がページごとに覚えておく (ETag, Last-Modified)。消えても次のリクエストで作り直すだけ
+    "last_modified": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "last_modified",
+        "TIMEOUT": 3600,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
 }
 
 
@@ -129,3 +203,48 @@ AUTH_USER_MODEL = "accounts.User"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
+
+# プロフィールに出す「おすすめユーザー」をユーザーごとに何件まで保存しておくか
+RECOMMENDATIONS_PER_USER = 20
+# フォロワーがこの人数を超えるユーザーがフォロー・アンフォローしても、フォロワーのおすすめはその場で更新しない
+# 自分のおすすめも、フォロー先とそのフォロー先を合わせてこの件数を超えて読むならその場では作り直さない
+RECOMMENDATION_FANOUT_FOLLOWER_THRESHOLD = 1000
+
+# フォロー関係をプロセス内の整数配列の索引から引く。索引はプロセスごとに持つので、
+# 複数プロセスで動かすときは他のプロセスでのフォローが再起動まで反映されないことに注意
+# 索引は起動時 (mysite/wsgi.py / asgi.py) にバックグラウンドで読み込み、読み込み終わるまでは DB から引く
+FOLLOW_GRAPH_INDEX = False
+
+# プロフィールとツイート詳細を async 版のビューで返す。ASGI (mysite/asgi.py) で動かすときに有効にする
+ASYNC_VIEWS = False
+# async 版のビューが並行に読み込むためのスレッド数。スレッドごとに接続を持ち、CONN_MAX_AGE に従って使い回す
+ASYNC_DB_READ_WORKERS = 8
+
+# ASGI で /tweets/live/ から Server-Sent Events で新しいツイートといいね数を送り、ホームで受け取る
+LIVE_UPDATES = False
+# いいね数はツイートごとにこの間隔で 1 回にまとめて送る
+LIVE_LIKE_INTERVAL_MS = 1000
+# 読み出しが追いつかない接続に溜めるイベント数の上限。超えると溜まった分を捨てて resync を送る
+LIVE_QUEUE_SIZE = 100
+LIVE_HEARTBEAT_SECONDS = 15
+
+# Home timeline
+# ホームタイムラインに保持する最大件数と、書き込み時のファンアウトを行わないフォロワー数のしきい値。
+# ファンアウトでは切り詰めないので、最大件数を超えた分は trim_timelines コマンドを定期的に実行して消す
+TIMELINE_MAX_ENTRIES = 800
+TIMELINE_FANOUT_FOLLOWER_THRESHOLD = 10000
+
+# HomeView とフォロー・フォロワー一覧を StreamingHttpResponse で返す
+STREAMING_RESPONSES = False
+
+# いいねを一定間隔でまとめて書き込む(write-behind)。未反映のイベントはプロセスごとのジャーナルに追記して保持し、
+# 落ちたプロセスのジャーナルは次に起動したプロセスが引き取る。書き込めないイベントは dead_letter.jsonl に移す
+LIKE_WRITE_BEHIND = False
+LIKE_WRITE_BEHIND_FLUSH_INTERVAL_MS = 200
+LIKE_WRITE_BEHIND_MAX_EVENTS = 500
+LIKE_WRITE_BEHIND_JOURNAL_DIR = BASE_DIR / "like_journal"
+
+# トレンド(ハッシュタグの出現数)。count-min sketch の幅と段数で見積もりの誤差とメモリ量が決まる
+TRENDING_TOP_K = 10
+TRENDING_SKETCH_WIDTH = 2048
+TRENDING_SKETCH_DEPTH = 4
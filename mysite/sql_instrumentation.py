@@ -0,0 +1,167 @@
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+# 計測中のリクエストの QueryRecorder。gather_reads のスレッドにはコンテキストごと引き継がれる
+_current_recorder = contextvars.ContextVar("sql_recorder", default=None)
+
+
+# 同じビューは同じ SQL 文字列を発行するので、正規化の結果はプロセス内で使い回す
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """リテラルとプレースホルダを ? に置き換え、IN (?, ?, ...) の個数の違いもまとめた SQL"""
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _VALUE_LIST.sub("(...)", sql)
+    return " ".join(sql.split())
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper に渡して、実行した SQL の回数と合計時間を記録する。
+    実行中は SQL 文字列ごとに数えるだけにしておき、正規化は最後に異なる文字列ごとに 1 回だけ行う。
+    gather_reads のスレッドからも並行に記録されるので、集計はロックを取って行う。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.duration += duration
+                self.count += 1
+                self.statements[sql] += 1
+
+    def fingerprints(self):
+        counts = Counter()
+        for sql, count in self.statements.items():
+            counts[fingerprint(sql)] += count
+        return counts
+
+
+def _wrap_connections(recorder):
+    # 接続はスレッドごとにあるので、このスレッドの接続にだけ効く
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+    return stack
+
+
+@contextmanager
+def record_thread_queries():
+    """
+    計測中のリクエストから別のスレッドで実行する読み込み (gather_reads) の SQL も、同じ QueryRecorder に記録する。
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        yield
+        return
+    with _wrap_connections(recorder):
+        yield
+
+
+class JSONFormatter(logging.Formatter):
+    """SQLInstrumentationMiddleware のログを 1 行の JSON にする"""
+
+    def format(self, record):
+        return json.dumps(
+            {"level": record.levelname, "message": record.getMessage(), **getattr(record, "sql", {})},
+            ensure_ascii=False,
+        )
+
+
+class SQLInstrumentationMiddleware:
+    """
+    SQL_INSTRUMENTATION_SAMPLE_RATE の割合のリクエスト (DEBUG のときはすべて) で、クエリ数と SQL の合計時間を
+    Server-Timing ヘッダーとログに出す。同じ形の SQL が SQL_N_PLUS_ONE_THRESHOLD 回を超えて実行されたら
+    N+1 の疑いとして WARNING で記録する。
+    StreamingHttpResponse は本文を返し終わるまで計測を続けてからログに出す。ヘッダーは本文より先に送るので付けない。
+    同期専用のミドルウェアなので、ASGI では Django がスレッドで実行する。async なビューの ORM の読み込みは
+    同じスレッドに戻って実行され、gather_reads のスレッドでの読み込みは record_thread_queries で数える。
+    それ以外に自前で立てたスレッドの SQL は数えない。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, "SQL_INSTRUMENTATION_SAMPLE_RATE", 0)
+        if random.random() >= sample_rate:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        with _wrap_connections(recorder) as stack:
+            token = _current_recorder.set(recorder)
+            try:
+                response = self.get_response(request)
+            finally:
+                _current_recorder.reset(token)
+            if response.streaming:
+                response.streaming_content = self.stream(
+                    request, response, response.streaming_content, recorder, stack.pop_all()
+                )
+                return response
+        duration_ms = self.report(request, response, recorder)
+        timing = f'db;dur={duration_ms:.1f};desc="{recorder.count} queries"'
+        response["Server-Timing"] = ", ".join(filter(None, [response.get("Server-Timing"), timing]))
+        return response
+
+    def stream(self, request, response, content, recorder, wrappers):
+        # テンプレートを 1 行ずつ描画しながら返すビューでは、N+1 は本文を返している間に起きる
+        with wrappers:
+            yield from content
+        self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        threshold = getattr(settings, "SQL_N_PLUS_ONE_THRESHOLD", 10)
+        repeated = [
+            {"fingerprint": sql, "count": count}
+            for sql, count in recorder.fingerprints().most_common()
+            if count > threshold
+        ]
+        duration_ms = recorder.duration * 1000
+        logger.log(
+            logging.WARNING if repeated else logging.INFO,
+            "%s %s: %d queries in %.1f ms%s",
+            request.method,
+            request.path,
+            recorder.count,
+            duration_ms,
+            f" (N+1 の疑い: {repeated[0]['count']} 回 {repeated[0]['fingerprint']})" if repeated else "",
+            extra={
+                "sql": {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "queries": recorder.count,
+                    "duration_ms": round(duration_ms, 3),
+                    "repeated": repeated,
+                }
+            },
+        )
+        return duration_ms
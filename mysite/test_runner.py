@@ -0,0 +1,17 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    テスト中はサンプリングした SQL の計測ログを出さない。計測のテストは override_settings で有効にする。
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._instrumentation = override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=0)
+        self._instrumentation.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._instrumentation.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,170 @@
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.views import View
+
+from accounts.models import User
+from tweets.models import Tweet
+
+from .async_db import gather_reads
+from .db_router import PIN_PRIMARY_COOKIE, ReplicaReadMixin, ReplicaRouter
+from .sql_instrumentation import QueryRecorder, SQLInstrumentationMiddleware, fingerprint
+
+
+class RoutedView(ReplicaReadMixin, View):
+    def get(self, request, *args, **kwargs):
+        return ReplicaRouter().db_for_read(Tweet)
+
+
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_writes_go_to_default(self):
+        self.assertEqual(ReplicaRouter().db_for_write(Tweet), "default")
+
+    @mock.patch("mysite.db_router.replica_available", return_value=True)
+    def test_reads_in_replica_views_go_to_replica(self, _):
+        self.assertEqual(RoutedView.as_view()(self.factory.get("/")), "replica")
+        self.assertEqual(ReplicaRouter().db_for_read(Tweet), "default")
+
+    @mock.patch("mysite.db_router.replica_available", return_value=True)
+    def test_reads_after_own_write_stick_to_default(self, _):
+        request = self.factory.get("/")
+        request.COOKIES[PIN_PRIMARY_COOKIE] = "1"
+        self.assertEqual(RoutedView.as_view()(request), "default")
+
+
+class TestReadYourWritesMiddleware(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.client.force_login(self.user)
+
+    def test_post_pins_primary(self):
+        response = self.client.post(reverse("tweets:create"), {"content": "A test tweet"})
+        self.assertEqual(response.cookies[PIN_PRIMARY_COOKIE]["max-age"], 5)
+
+    def test_get_does_not_pin_primary(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotIn(PIN_PRIMARY_COOKIE, response.cookies)
+
+
+class TestGatherReads(SimpleTestCase):
+    def test_reads_run_concurrently(self):
+        def read(value):
+            time.sleep(0.2)
+            return value
+
+        start = time.perf_counter()
+        results = async_to_sync(gather_reads)(lambda: read(1), lambda: read(2), lambda: read(3))
+        self.assertEqual(results, [1, 2, 3])
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+
+class TestGatherReadsConnections(TransactionTestCase):
+    def test_reads_share_a_bounded_pool(self):
+        created = []
+
+        def on_connection_created(sender, connection, **kwargs):
+            created.append(threading.current_thread().name)
+
+        def read():
+            User.objects.exists()
+            return threading.current_thread().name
+
+        connection_created.connect(on_connection_created)
+        self.addCleanup(connection_created.disconnect, on_connection_created)
+        threads = [name for _ in range(10) for name in async_to_sync(gather_reads)(read, read)]
+        self.assertTrue(all(name.startswith("db-read") for name in threads))
+        self.assertLessEqual(len(created), settings.ASYNC_DB_READ_WORKERS)
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_reads_are_instrumented(self):
+        # gather_reads のスレッドで実行した SQL も、呼び出し元のリクエストの計測に入る
+        recorders = []
+
+        class Recorder(QueryRecorder):
+            def __init__(self):
+                super().__init__()
+                recorders.append(self)
+
+        def get_response(request):
+            async_to_sync(gather_reads)(lambda: User.objects.exists(), lambda: list(Tweet.objects.all()))
+            return HttpResponse()
+
+        with mock.patch("mysite.sql_instrumentation.QueryRecorder", Recorder), self.assertLogs(
+            "mysite.sql_instrumentation"
+        ):
+            response = SQLInstrumentationMiddleware(get_response)(RequestFactory().get("/"))
+        [recorder] = recorders
+        # 新しく開いた接続の初期化 (PRAGMA) も数えるので、読み込みの SQL だけを確かめる
+        tables = [table for table in ["accounts_user", "tweets_tweet"] for sql in recorder.statements if table in sql]
+        self.assertEqual(tables, ["accounts_user", "tweets_tweet"])
+        self.assertIn(f'desc="{recorder.count} queries"', response["Server-Timing"])
+
+
+@override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1.0, SQL_N_PLUS_ONE_THRESHOLD=3)
+class TestSQLInstrumentationMiddleware(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(5)]
+        self.request = RequestFactory().get("/tweets/home/")
+
+    def view(self, per_tweet):
+        def get_response(request):
+            tweets = list(Tweet.objects.all())
+            if per_tweet:
+                for tweet in tweets:
+                    tweet.user.username
+            response = HttpResponse()
+            response["Server-Timing"] = "app;dur=1.0"
+            return response
+
+        return SQLInstrumentationMiddleware(get_response)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM "t" WHERE "id" IN (%s, %s) AND "name" = \'a\' LIMIT 21'),
+            'SELECT * FROM "t" WHERE "id" IN (...) AND "name" = ? LIMIT ?',
+        )
+        self.assertEqual(fingerprint('SELECT "t1"."id" FROM "t1"'), 'SELECT "t1"."id" FROM "t1"')
+
+    def test_server_timing(self):
+        with self.assertLogs("mysite.sql_instrumentation", "INFO") as logs:
+            response = self.view(per_tweet=False)(self.request)
+        self.assertRegex(response["Server-Timing"], r'^app;dur=1.0, db;dur=[0-9.]+;desc="1 queries"$')
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        self.assertEqual(logs.records[0].sql["queries"], 1)
+        self.assertEqual(logs.records[0].sql["repeated"], [])
+
+    def test_n_plus_one_is_flagged(self):
+        with self.assertLogs("mysite.sql_instrumentation", "WARNING") as logs:
+            response = self.view(per_tweet=True)(self.request)
+        self.assertIn('desc="6 queries"', response["Server-Timing"])
+        [repeated] = logs.records[0].sql["repeated"]
+        self.assertEqual(repeated["count"], 5)
+        self.assertIn('FROM "accounts_user" WHERE "accounts_user"."id" = ?', repeated["fingerprint"])
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        with self.assertNoLogs("mysite.sql_instrumentation"):
+            response = self.view(per_tweet=True)(self.request)
+        self.assertEqual(response["Server-Timing"], "app;dur=1.0")
+
+    def test_queries_while_streaming_are_counted(self):
+        def get_response(request):
+            return StreamingHttpResponse(tweet.user.username for tweet in Tweet.objects.all())
+
+        with self.assertNoLogs("mysite.sql_instrumentation"):
+            response = SQLInstrumentationMiddleware(get_response)(self.request)
+        with self.assertLogs("mysite.sql_instrumentation", "WARNING") as logs:
+            self.assertEqual(b"".join(response.streaming_content), b"tester" * 5)
+        self.assertEqual(logs.records[0].sql["queries"], 6)
+        self.assertNotIn("Server-Timing", response)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
 application = get_wsgi_application()
+
+from accounts.follow_graph import start_follow_graph_loader  # noqa: E402
+
+# フォロー関係の索引を使うなら、最初のリクエストを待たずに読み込み始める
+start_follow_graph_loader()
@@ -0,0 +1,104 @@
+import bisect
+import threading
+import time
+from array import array
+
+from django.core.cache import caches
+
+from tweets.models import Like
+
+
+class LikedTweetCache:
+    """
+    ユーザーごとのいいね済みツイート id を昇順の 64bit 整数配列としてキャッシュする。
+    判定は二分探索で行い、いいね・いいね取り消しはコミット後にライトスルーで反映する。
+    配列はユーザーごとの版と一緒に保存し、版が一致するときだけ使う。書き込みは incr で版を 1 つ進め、
+    キャッシュが直前の版のときだけ差分を当てる。並行な書き込みと前後して直前の版でなければ何もしないので、
+    他の書き込みを上書きすることはなく、版の合わない配列は次の読み込みで DB から作り直される。
+    """
+
+    def __init__(self, alias="likes"):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, user_id):
+        return f"liked_tweets:{user_id}"
+
+    def version_key(self, user_id):
+        return f"liked_tweets_version:{user_id}"
+
+    def _new_version(self, user_id):
+        # 消えた版を作り直すときは時刻を使い、以前の版と重ならないようにする
+        self.cache.add(self.version_key(user_id), time.time_ns())
+        return self.cache.get(self.version_key(user_id))
+
+    def _load(self, user_id):
+        ids = Like.objects.filter(likeuser_id=user_id).values_list("likedtweet_id", flat=True)
+        return array("q", ids.order_by("likedtweet_id"))
+
+    def get(self, user_id):
+        values = self.cache.get_many([self.key(user_id), self.version_key(user_id)])
+        version = values.get(self.version_key(user_id))
+        if version is None:
+            version = self._new_version(user_id)
+        entry = values.get(self.key(user_id))
+        hit = entry is not None and entry[0] == version
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            ids = self._load(user_id)
+            self.cache.set(self.key(user_id), (version, ids.tobytes()))
+            return ids
+        ids = array("q")
+        ids.frombytes(entry[1])
+        return ids
+
+    @staticmethod
+    def contains(ids, tweet_id):
+        i = bisect.bisect_left(ids, tweet_id)
+        return i < len(ids) and ids[i] == tweet_id
+
+    def update(self, user_id, changes):
+        """
+        コミット後に呼び、{tweet_id: liked} をキャッシュに反映する。
+        """
+        try:
+            version = self.cache.incr(self.version_key(user_id))
+        except ValueError:
+            # 版が消えていれば配列も使われないので、新しい版を作るだけでよい
+            self._new_version(user_id)
+            return
+        entry = self.cache.get(self.key(user_id))
+        if entry is None or entry[0] != version - 1:
+            return
+        ids = array("q")
+        ids.frombytes(entry[1])
+        for tweet_id, liked in changes.items():
+            i = bisect.bisect_left(ids, tweet_id)
+            found = i < len(ids) and ids[i] == tweet_id
+            if liked and not found:
+                ids.insert(i, tweet_id)
+            elif not liked and found:
+                del ids[i]
+        self.cache.set(self.key(user_id), (version, ids.tobytes()))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+liked_tweet_cache = LikedTweetCache()
@@ -0,0 +1,101 @@
+import hashlib
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from tweets.models import Tweet
+
+
+def _like_set_key(user_id):
+    return f"like_set_version:{user_id}"
+
+
+def like_set_version(user_id):
+    # キャッシュから消えたら新しい値で作り直す。以前の値と重ならないので古い ETag が一致することはない
+    cache = caches["likes"]
+    version = cache.get(_like_set_key(user_id))
+    if version is None:
+        version = time.time_ns()
+        cache.add(_like_set_key(user_id), version)
+    return version
+
+
+def bump_like_set_version(user_id):
+    caches["likes"].set(_like_set_key(user_id), time.time_ns())
+
+
+def tweet_versions(tweet_ids):
+    versions = dict(Tweet.objects.filter(id__in=tweet_ids).values_list("id", "version"))
+    return [(tweet_id, versions.get(tweet_id)) for tweet_id in tweet_ids]
+
+
+class ConditionalGetMixin:
+    """
+    ページの中身を決める値 (get_validator_parts) から ETag と Last-Modified を作り、
+    If-None-Match / If-Modified-Since が一致すればテンプレートを描画せずに 304 を返す。
+    """
+
+    def get_validator_parts(self):
+        raise NotImplementedError
+
+    def get_validators(self):
+        request = self.request
+        parts = [
+            request.user.id,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+            *self.get_validator_parts(),
+        ]
+        etag = quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+        # Last-Modified は ETag が変わった時刻。秒単位なので、同じページでは前回より必ず 1 秒以上進める
+        key = "last_modified:" + hashlib.md5(f"{request.user.id}:{request.get_full_path()}".encode()).hexdigest()
+        cache = caches["last_modified"]
+        previous = cache.get(key)
+        if previous is not None and previous[0] == etag:
+            last_modified = previous[1]
+        else:
+            last_modified = math.ceil(time.time())
+            if previous is not None:
+                last_modified = max(last_modified, previous[1] + 1)
+            cache.set(key, (etag, last_modified))
+        return etag, last_modified
+
+    def get_conditional_response(self):
+        # (ETag, Last-Modified, If-None-Match / If-Modified-Since が一致したときの 304 レスポンスか None)
+        etag, last_modified = self.get_validators()
+        return etag, last_modified, get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+
+    @staticmethod
+    def set_validator_headers(response, etag, last_modified):
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(last_modified))
+        return response
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified, response = self.get_conditional_response()
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
+
+
+class AsyncConditionalGetMixin(ConditionalGetMixin):
+    """
+    async なビュー用の ConditionalGetMixin。ページの本体は get ではなく get_page に書く。
+    ETag は閲覧者ごとに作るので、同期版の LoginRequiredMixin と同じく、ログインしていなければ先にログイン画面へ送る。
+    """
+
+    async def get_page(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        etag, last_modified, response = await sync_to_async(self.get_conditional_response)()
+        if response is None:
+            response = await self.get_page(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
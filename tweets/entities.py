@@ -0,0 +1,55 @@
+import re
+
+from django.contrib.auth import get_user_model
+
+from tweets.models import Hashtag, Mention, TweetTag
+
+User = get_user_model()
+
+# URL のフラグメント (/#anchor) やメールアドレス (a@example.com) を拾わないよう、直前が語の途中や URL でないものに限る。
+# 保存できる長さを超えるものはタグ・メンションとして扱わない
+HASHTAG_RE = re.compile(r"(?<![\w/&#＃])[#＃](\w{1,%d})(?!\w)" % Hashtag._meta.get_field("name").max_length)
+MENTION_RE = re.compile(
+    r"(?<![\w.+\-/@])@(\w[\w.+-]{0,%d})(?![\w+\-@])" % (User._meta.get_field("username").max_length - 1)
+)
+
+
+def extract_hashtags(content):
+    return list(dict.fromkeys(name.casefold() for name in HASHTAG_RE.findall(content)))
+
+
+def extract_mentions(content):
+    return list(dict.fromkeys(username.rstrip(".") for username in MENTION_RE.findall(content)))
+
+
+def index_tweet_entities(tweets):
+    """
+    ツイート本文からハッシュタグとメンションを取り出し、TweetTag / Mention に書き込む。
+    複数のツイートをまとめて渡すと、ハッシュタグとユーザーの解決も 1 回ずつで済む。
+    """
+    hashtags = {tweet.id: extract_hashtags(tweet.content) for tweet in tweets}
+    mentions = {tweet.id: extract_mentions(tweet.content) for tweet in tweets}
+
+    names = {name for tweet_names in hashtags.values() for name in tweet_names}
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+    hashtag_ids = dict(Hashtag.objects.filter(name__in=names).values_list("name", "id"))
+    usernames = {username for tweet_usernames in mentions.values() for username in tweet_usernames}
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+
+    TweetTag.objects.bulk_create(
+        [
+            TweetTag(tweet=tweet, hashtag_id=hashtag_ids[name], created_at=tweet.created_at)
+            for tweet in tweets
+            for name in hashtags[tweet.id]
+        ],
+        ignore_conflicts=True,
+    )
+    Mention.objects.bulk_create(
+        [
+            Mention(tweet=tweet, user_id=user_ids[username], created_at=tweet.created_at)
+            for tweet in tweets
+            for username in mentions[tweet.id]
+            if username in user_ids
+        ],
+        ignore_conflicts=True,
+    )
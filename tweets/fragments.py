@@ -0,0 +1,46 @@
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+LIKE_BUTTON_PLACEHOLDER = "<!--like-button-->"
+TWEET_FRAGMENT_TEMPLATES = [
+    "tweets/tweet_item.html",
+    "tweets/tweet_detail_item.html",
+    "accounts/tweet_item.html",
+]
+
+
+def fragment_key(template_name, tweet):
+    # id は再利用されうるので作成日時も含め、いいね数などが変わるたびに version で切り替える。
+    # 未反映のいいねを重ねた likes_count も HTML に出るのでキーに含める
+    return f"tweet_html:{template_name}:{tweet.id}:{tweet.created_at.timestamp()}:{tweet.version}:{tweet.likes_count}"
+
+
+def render_tweet(tweet, template_name):
+    """
+    閲覧者に依存しないツイートの HTML をキャッシュし、いいねボタンだけを後から差し込む。
+    """
+    cache = caches["fragments"]
+    key = fragment_key(template_name, tweet)
+    cached = cache.get(key)
+    if cached is None:
+        html = render_to_string(template_name, {"tweet": tweet, "like_button": mark_safe(LIKE_BUTTON_PLACEHOLDER)})
+        like_url = reverse("tweets:like", kwargs={"pk": tweet.id})
+        unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet.id})
+        cached = (html, like_url, unlike_url)
+        cache.set(key, cached)
+    html, like_url, unlike_url = cached
+    if getattr(tweet, "is_liked", False):
+        url, label = unlike_url, "いいね取り消し"
+    else:
+        url, label = like_url, "いいね"
+    button = format_html(
+        '<button type="button" id="tweet-{}" onclick="toggleLike(id)" data-url="{}">{}</button>', tweet.id, url, label
+    )
+    return mark_safe(html.replace(LIKE_BUTTON_PLACEHOLDER, button))
+
+
+def invalidate_tweet(tweet):
+    caches["fragments"].delete_many([fragment_key(template_name, tweet) for template_name in TWEET_FRAGMENT_TEMPLATES])
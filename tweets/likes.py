@@ -0,0 +1,210 @@
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, F, OuterRef, PositiveIntegerField, QuerySet, When
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+
+from tweets.cache import liked_tweet_cache
+from tweets.conditional import bump_like_set_version
+from tweets.models import Like, Tweet
+from tweets.write_behind import LikeBuffer
+
+# いいね数が変わったときにコミット後に送る。counts は {tweet_id: (増減, 反映後のいいね数)}
+likes_changed = Signal()
+
+_like_buffer = None
+_like_buffer_lock = threading.Lock()
+
+
+def _send_likes_changed(counts):
+    transaction.on_commit(lambda: likes_changed.send(sender=Tweet, counts=counts))
+
+
+def _update_liked_tweets(user_id, changes):
+    # 外側のトランザクションがコミットされる前に反映すると、取り消されたときに古い状態が残るのでコミット後に行う
+    transaction.on_commit(lambda: liked_tweet_cache.update(user_id, changes))
+
+
+def add_like(user, tweet):
+    with transaction.atomic():
+        _, created = Like.objects.get_or_create(likeuser=user, likedtweet=tweet)
+        if created:
+            Tweet.objects.filter(pk=tweet.pk).update(likes_count=F("likes_count") + 1, version=F("version") + 1)
+    if created:
+        _update_liked_tweets(user.id, {tweet.id: True})
+        bump_like_set_version(user.id)
+    tweet.refresh_from_db(fields=["likes_count", "version"])
+    if created:
+        _send_likes_changed({tweet.id: (1, tweet.likes_count)})
+    return created
+
+
+def remove_like(user, tweet):
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(likeuser=user, likedtweet=tweet).delete()
+        if deleted:
+            Tweet.objects.filter(pk=tweet.pk).update(
+                likes_count=Greatest(F("likes_count") - deleted, 0), version=F("version") + 1
+            )
+    if deleted:
+        _update_liked_tweets(user.id, {tweet.id: False})
+        bump_like_set_version(user.id)
+    tweet.refresh_from_db(fields=["likes_count", "version"])
+    if deleted:
+        _send_likes_changed({tweet.id: (-1, tweet.likes_count)})
+    return bool(deleted)
+
+
+def _liked_tweet_ids(user_id, tweet_ids):
+    likes = Like.objects.filter(likeuser_id=user_id, likedtweet_id__in=tweet_ids)
+    return set(likes.values_list("likedtweet_id", flat=True))
+
+
+def _insert_likes(user_id, tweet_ids):
+    """
+    いいねを挿入し、実際に挿入できた tweet_id を返す。読み込んだ後に同じいいねが並行して挿入されていたら
+    一括挿入を取り消して 1 件ずつ挿入し直し、挿入できたものだけを数える。
+    """
+    try:
+        with transaction.atomic():
+            Like.objects.bulk_create([Like(likeuser_id=user_id, likedtweet_id=tweet_id) for tweet_id in tweet_ids])
+        return list(tweet_ids)
+    except IntegrityError:
+        pass
+    inserted = []
+    for tweet_id in tweet_ids:
+        try:
+            with transaction.atomic():
+                Like.objects.create(likeuser_id=user_id, likedtweet_id=tweet_id)
+        except IntegrityError:
+            continue
+        inserted.append(tweet_id)
+    return inserted
+
+
+def _delete_likes(user_id, tweet_ids):
+    """
+    いいねを削除し、実際に削除できた tweet_id を返す。並行して削除されていて件数が合わなければ
+    一括削除を取り消して 1 件ずつ削除し直す。
+    """
+    savepoint = transaction.savepoint()
+    deleted, _ = Like.objects.filter(likeuser_id=user_id, likedtweet_id__in=tweet_ids).delete()
+    if deleted == len(tweet_ids):
+        transaction.savepoint_commit(savepoint)
+        return list(tweet_ids)
+    transaction.savepoint_rollback(savepoint)
+    return [
+        tweet_id
+        for tweet_id in tweet_ids
+        if Like.objects.filter(likeuser_id=user_id, likedtweet_id=tweet_id).delete()[0]
+    ]
+
+
+def apply_like_operations(user_id, operations):
+    """
+    (tweet_id, liked) の列をまとめて反映する。同じツイートへの操作は最後のものだけを使う。
+    一括の INSERT と DELETE で書き込み、実際に増減した行の分だけいいね数を 1 回の UPDATE で更新する。
+    反映後の {tweet_id: likes_count} を返す(存在しないツイートは含まない)。
+    """
+    wanted = dict(operations)
+    with transaction.atomic():
+        tweet_ids = set(Tweet.objects.filter(id__in=wanted).values_list("id", flat=True))
+        liked_ids = _liked_tweet_ids(user_id, tweet_ids)
+        to_like = _insert_likes(
+            user_id, [tweet_id for tweet_id in tweet_ids if wanted[tweet_id] and tweet_id not in liked_ids]
+        )
+        to_unlike = _delete_likes(
+            user_id, [tweet_id for tweet_id in tweet_ids if not wanted[tweet_id] and tweet_id in liked_ids]
+        )
+        deltas = [When(id=tweet_id, then=F("likes_count") + 1) for tweet_id in to_like] + [
+            When(id=tweet_id, then=Greatest(F("likes_count") - 1, 0)) for tweet_id in to_unlike
+        ]
+        if deltas:
+            Tweet.objects.filter(id__in=[*to_like, *to_unlike]).update(
+                likes_count=Case(*deltas, default=F("likes_count"), output_field=PositiveIntegerField()),
+                version=F("version") + 1,
+            )
+    deltas = {**{tweet_id: 1 for tweet_id in to_like}, **{tweet_id: -1 for tweet_id in to_unlike}}
+    if deltas:
+        _update_liked_tweets(user_id, {tweet_id: delta > 0 for tweet_id, delta in deltas.items()})
+        bump_like_set_version(user_id)
+    likes_counts = dict(Tweet.objects.filter(id__in=tweet_ids).values_list("id", "likes_count"))
+    if deltas:
+        _send_likes_changed({tweet_id: (delta, likes_counts[tweet_id]) for tweet_id, delta in deltas.items()})
+    return likes_counts
+
+
+def get_like_buffer():
+    """
+    LIKE_WRITE_BEHIND が有効なら、初回呼び出し時に持ち主のいないジャーナルを再生してフラッシュ用スレッドを起動する。
+    """
+    global _like_buffer
+    if not getattr(settings, "LIKE_WRITE_BEHIND", False):
+        return None
+    with _like_buffer_lock:
+        if _like_buffer is None:
+            _like_buffer = LikeBuffer(
+                settings.LIKE_WRITE_BEHIND_JOURNAL_DIR,
+                apply=apply_like_operations,
+                flush_interval=settings.LIKE_WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+                max_events=settings.LIKE_WRITE_BEHIND_MAX_EVENTS,
+            )
+            _like_buffer.start()
+    return _like_buffer
+
+
+def set_like(user, tweet, liked):
+    """
+    いいね状態を変更し、閲覧者から見たいいね数を返す。
+    書き込みを遅延させる場合は未反映のイベントを重ねた値になる。
+    """
+    buffer = get_like_buffer()
+    if buffer is None:
+        if liked:
+            add_like(user, tweet)
+        else:
+            remove_like(user, tweet)
+        return tweet.likes_count
+    buffer.enqueue(user.id, tweet.id, liked)
+    bump_like_set_version(user.id)
+    return tweet.likes_count + buffer.count_deltas([tweet.id])[tweet.id]
+
+
+def set_likes(user_id, operations):
+    """
+    (tweet_id, liked) の列をまとめて反映し、閲覧者から見た {tweet_id: likes_count} を返す。
+    LIKE_WRITE_BEHIND が有効なら set_like と同じくバッファに積み、1 件ずつのいいねと順序を揃える。
+    """
+    buffer = get_like_buffer()
+    if buffer is None:
+        return apply_like_operations(user_id, operations)
+    wanted = dict(operations)
+    likes_counts = dict(Tweet.objects.filter(id__in=wanted).values_list("id", "likes_count"))
+    for tweet_id in likes_counts:
+        buffer.enqueue(user_id, tweet_id, wanted[tweet_id])
+    if likes_counts:
+        bump_like_set_version(user_id)
+    deltas = buffer.count_deltas(likes_counts)
+    return {tweet_id: likes_count + deltas[tweet_id] for tweet_id, likes_count in likes_counts.items()}
+
+
+def with_liked_state(tweets, user, liked_ids=None):
+    """
+    表示するツイートにだけ閲覧者のいいね状態 (is_liked) を付ける。
+    QuerySet なら EXISTS で注釈し、評価済みのリストならいいね済み id のキャッシュで判定する。
+    liked_ids には読み込み済みの liked_tweet_cache.get(user.id) を渡せる。
+    """
+    if isinstance(tweets, QuerySet):
+        return tweets.annotate(is_liked=Exists(Like.objects.filter(likeuser=user, likedtweet=OuterRef("pk"))))
+    tweets = list(tweets)
+    if liked_ids is None:
+        liked_ids = liked_tweet_cache.get(user.id)
+    buffer = get_like_buffer()
+    overlay = buffer.liked_overlay(user.id) if buffer else {}
+    deltas = buffer.count_deltas([tweet.id for tweet in tweets]) if buffer else {}
+    for tweet in tweets:
+        tweet.is_liked = overlay.get(tweet.id, liked_tweet_cache.contains(liked_ids, tweet.id))
+        tweet.likes_count += deltas.get(tweet.id, 0)
+    return tweets
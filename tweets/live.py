@@ -0,0 +1,182 @@
+import asyncio
+import json
+import threading
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest, parse_cookie
+
+from accounts.models import FriendShip
+
+LIVE_PATH = "/tweets/live/"
+
+
+class Subscriber:
+    def __init__(self, user_id, loop, max_queue):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queue)
+
+    def offer(self, event):
+        # イベントループのスレッドで呼ばれる
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 読み出しが追いつかない購読者には溜まった分を捨て、ページの読み込み直しを促す
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("resync", {}))
+
+
+class LiveHub:
+    """
+    プロセス内の pub/sub。publish は同期コード (シグナル) から呼べ、各購読者のイベントループに渡す。
+    いいね数の変化はツイートごとにまとめ、like_interval 秒に 1 回だけ送る。
+    """
+
+    def __init__(self, like_interval=None, max_queue=None):
+        self._like_interval = like_interval
+        self._max_queue = max_queue
+        self._subscribers = set()
+        self._pending_likes = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    # 指定がなければ、override_settings が効くよう使うたびに設定を読む
+    @property
+    def like_interval(self):
+        if self._like_interval is not None:
+            return self._like_interval
+        return getattr(settings, "LIVE_LIKE_INTERVAL_MS", 1000) / 1000
+
+    @property
+    def max_queue(self):
+        if self._max_queue is not None:
+            return self._max_queue
+        return getattr(settings, "LIVE_QUEUE_SIZE", 100)
+
+    def subscribe(self, user_id):
+        subscriber = Subscriber(user_id, asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def user_ids(self):
+        with self._lock:
+            return {subscriber.user_id for subscriber in self._subscribers}
+
+    def publish(self, event, data, user_ids=None):
+        with self._lock:
+            subscribers = [s for s in self._subscribers if user_ids is None or s.user_id in user_ids]
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.offer, (event, data))
+
+    def publish_like_counts(self, counts):
+        """
+        counts は {tweet_id: (増減, 反映後のいいね数)}。
+        """
+        with self._lock:
+            if not self._subscribers:
+                return
+            for tweet_id, (delta, likes_count) in counts.items():
+                pending_delta = self._pending_likes.get(tweet_id, (0, None))[0]
+                self._pending_likes[tweet_id] = (pending_delta + delta, likes_count)
+            if self._timer is None:
+                self._timer = threading.Timer(self.like_interval, self.flush_likes)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush_likes(self):
+        with self._lock:
+            pending, self._pending_likes = self._pending_likes, {}
+            self._timer = None
+        if pending:
+            likes = [
+                {"tweet_id": tweet_id, "delta": delta, "likes_count": likes_count}
+                for tweet_id, (delta, likes_count) in pending.items()
+            ]
+            self.publish("likes", likes)
+
+
+live_hub = LiveHub()
+
+
+def notify_new_tweet(tweet):
+    # 接続中のユーザーのうち、投稿者本人とフォロワーにだけ送る
+    user_ids = live_hub.user_ids()
+    if not user_ids:
+        return
+    followers = FriendShip.objects.filter(followee_id=tweet.user_id, follower_id__in=user_ids)
+    recipients = set(followers.values_list("follower_id", flat=True)) | {tweet.user_id}
+    live_hub.publish("tweet", {"id": tweet.id, "user_id": tweet.user_id}, recipients)
+
+
+def _authenticate(scope):
+    headers = dict(scope.get("headers", []))
+    cookies = parse_cookie(headers.get(b"cookie", b"").decode("latin1"))
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    try:
+        user = get_user(request)
+        return user.id if user.is_authenticated else None
+    finally:
+        close_old_connections()
+
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+async def _send_error(send, status, body):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def live_application(scope, receive, send):
+    """
+    Server-Sent Events で新しいツイートといいね数の変化を送る ASGI アプリケーション。
+    Django 4.1 の StreamingHttpResponse は ASGI でも同期的に読まれるので、ビューではなく ASGI で直接実装する。
+    """
+    if not getattr(settings, "LIVE_UPDATES", False):
+        await _send_error(send, 404, b"Not Found")
+        return
+    user_id = await sync_to_async(_authenticate)(scope)
+    if user_id is None:
+        await _send_error(send, 403, b"Forbidden")
+        return
+    subscriber = live_hub.subscribe(user_id)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    heartbeat = getattr(settings, "LIVE_HEARTBEAT_SECONDS", 15)
+    try:
+        headers = [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+        while not disconnect.done():
+            get = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({get, disconnect}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                # send はクライアントが読むまで待つので、遅い購読者のキューが溢れて resync になる
+                await send({"type": "http.response.body", "body": _format_event(*get.result()), "more_body": True})
+            else:
+                get.cancel()
+                if not disconnect.done():
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+    finally:
+        live_hub.unsubscribe(subscriber)
+        disconnect.cancel()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from tweets.entities import index_tweet_entities
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "既存のツイートからハッシュタグとメンションを取り出してインデックスに書き込む"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, chunk_size, **options):
+        last_id = Tweet.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        indexed = 0
+        for start in range(0, last_id + 1, chunk_size):
+            tweets = Tweet.objects.filter(id__gte=start, id__lt=start + chunk_size)
+            tweets = list(tweets.only("id", "content", "created_at"))
+            with transaction.atomic():
+                index_tweet_entities(tweets)
+            indexed += len(tweets)
+        self.stdout.write(self.style.SUCCESS(f"{indexed} 件のツイートを処理しました。"))
@@ -0,0 +1,163 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+from io import StringIO
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.urls import reverse
+
+from accounts.models import FriendShip
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "主要なビューをテストクライアントで繰り返し呼び出し、p50/p95 のレイテンシ・クエリ数・ピークメモリを JSON で出す。"
+        "--sizes を指定すると、ユーザー数ごとにテスト用データベースを作って generate_fake_data で埋めてから測る"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", help="ユーザー数をカンマ区切りで指定する (例: 1000,10000)。省略すると今のデータベースで測る"
+        )
+        parser.add_argument("--follows-per-user", type=int, default=20)
+        parser.add_argument("--tweets-per-user", type=int, default=10)
+        parser.add_argument("--likes-per-user", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--output", help="結果の JSON を書き込むファイル。省略すると標準出力に出す")
+
+    def handle(self, *args, sizes, iterations, warmup, output, **options):
+        if iterations < 2:
+            raise CommandError("--iterations は 2 以上にしてください。")
+        self.iterations = iterations
+        self.warmup = warmup
+        results = []
+        if sizes:
+            for users in [int(size) for size in sizes.split(",")]:
+                old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+                try:
+                    # SQLite のインメモリのテスト用データベースは接続を閉じても消えないので、前のサイズのデータを消しておく
+                    call_command("flush", interactive=False, verbosity=0)
+                    call_command(
+                        "generate_fake_data",
+                        users=users,
+                        follows=users * options["follows_per_user"],
+                        tweets=users * options["tweets_per_user"],
+                        likes=users * options["likes_per_user"],
+                        seed=options["seed"],
+                        timelines=True,
+                        stdout=StringIO(),
+                    )
+                    results.append(self.run_all())
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+        else:
+            results.append(self.run_all())
+        report = json.dumps(
+            {"python": platform.python_version(), "django": django.get_version(), "results": results},
+            indent=2,
+            sort_keys=True,
+        )
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+        else:
+            self.stdout.write(report)
+
+    def run_all(self):
+        viewer = User.objects.order_by("-userprofile__following_count", "id").first()
+        popular = User.objects.order_by("-userprofile__followers_count", "id").first()
+        tweet = Tweet.objects.order_by("-likes_count", "-id").first()
+        if viewer is None or tweet is None:
+            raise CommandError("ユーザーとツイートがありません。先に generate_fake_data を実行してください。")
+        client = Client()
+        client.force_login(viewer)
+        like_url = reverse("tweets:like", kwargs={"pk": tweet.pk})
+        unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet.pk})
+        views = {
+            "home": lambda: client.get(reverse("tweets:home")),
+            "profile": lambda: client.get(reverse("accounts:user_profile", kwargs={"username": popular.username})),
+            "tweet_detail": lambda: client.get(reverse("tweets:detail", kwargs={"pk": tweet.pk})),
+            "like": lambda: client.post(like_url),
+            "follower_list": lambda: client.get(
+                reverse("accounts:follower_list", kwargs={"username": popular.username})
+            ),
+            "following_list": lambda: client.get(
+                reverse("accounts:following_list", kwargs={"username": viewer.username})
+            ),
+        }
+        # いいねは毎回「いいねしていない」状態から測る
+        reset = {"like": lambda: client.post(unlike_url)}
+        # 計測のログを出すと測る時間に入るので、サンプリングは止めておく
+        with override_settings(ALLOWED_HOSTS=["testserver"], SQL_INSTRUMENTATION_SAMPLE_RATE=0):
+            measured = {name: self.measure(request, reset.get(name)) for name, request in views.items()}
+        return {
+            "rows": {
+                "users": User.objects.count(),
+                "follows": FriendShip.objects.count(),
+                "tweets": Tweet.objects.count(),
+                "likes": Like.objects.count(),
+                "timeline_entries": TimelineEntry.objects.count(),
+            },
+            "views": measured,
+        }
+
+    def measure(self, request, reset=None):
+        def call():
+            response = request()
+            if response.streaming:
+                b"".join(response.streaming_content)
+            return response
+
+        def timed():
+            if reset:
+                reset()
+            start = time.perf_counter()
+            call()
+            return time.perf_counter() - start
+
+        for _ in range(self.warmup):
+            timed()
+        latencies = [timed() for _ in range(self.iterations)]
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+
+        if reset:
+            reset()
+        reset_queries()
+        with ExitStack() as stack:
+            # レプリカに読み込みを送っているならその接続のクエリも数える
+            opened = [connection for connection in connections.all() if connection.connection is not None]
+            captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in opened]
+            response = call()
+        queries = sum(len(context) for context in captured)
+
+        # tracemalloc は呼び出しを遅くするので、レイテンシとは別の 1 回で測る
+        if reset:
+            reset()
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "status": response.status_code,
+            "p50_ms": round(percentiles[49] * 1000, 3),
+            "p95_ms": round(percentiles[94] * 1000, 3),
+            "queries": queries,
+            "peak_memory_kib": round(peak / 1024, 1),
+        }
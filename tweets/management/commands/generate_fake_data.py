@@ -0,0 +1,210 @@
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.models import FriendShip, UserProfile
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+WORDS = ["今日", "明日", "ランチ", "コーヒー", "仕事", "勉強", "散歩", "映画", "音楽", "天気", "電車", "週末"]
+
+
+def zipf_weights(n, exponent):
+    """順位 i (0 始まり) の重みを 1 / (i + 1)^exponent とした累積重み"""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def distribute(rng, total, cum_weights, cap, batch_size=100000):
+    """
+    total 件を累積重みに従って各要素に割り振る。cap 件に達した要素に当たった分は引き直すので、
+    割り振れるのは最大で len(cum_weights) * cap 件になる
+    """
+    counts = array("q", bytes(8 * len(cum_weights)))
+    population = range(len(cum_weights))
+    remaining = min(total, len(cum_weights) * cap)
+    while remaining:
+        for index in rng.choices(population, cum_weights=cum_weights, k=min(batch_size, remaining)):
+            if counts[index] < cap:
+                counts[index] += 1
+                remaining -= 1
+    return counts
+
+
+def sample_distinct(rng, cum_weights, k, exclude=None):
+    """累積重みに従って重複なしで k 件選ぶ。k が母集団に対して大きいときは一様に選ぶ"""
+    n = len(cum_weights)
+    if k * 4 > n:
+        chosen = set(rng.sample(range(n), min(k + 1, n)))
+        chosen.discard(exclude)
+        return list(chosen)[:k]
+    chosen = set()
+    while len(chosen) < k:
+        chosen.update(rng.choices(range(n), cum_weights=cum_weights, k=k - len(chosen)))
+        chosen.discard(exclude)
+    return list(chosen)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """auto_now_add を一時的に止め、生成した created_at をそのまま書き込めるようにする"""
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "ベンチマーク用にユーザー・フォロー関係・ツイート・いいねを生成する。"
+        "フォローとツイート・いいねの偏りは Zipf 分布にする"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--follows", type=int, default=20000, help="FriendShip の件数")
+        parser.add_argument("--tweets", type=int, default=10000)
+        parser.add_argument("--likes", type=int, default=50000)
+        parser.add_argument("--exponent", type=float, default=1.0, help="Zipf 分布の指数。大きいほど偏る")
+        parser.add_argument("--days", type=int, default=30, help="created_at を散らす日数")
+        parser.add_argument("--prefix", default="user")
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--timelines", action="store_true", help="生成後にホームタイムラインを作り直す")
+
+    def handle(self, *args, users, follows, tweets, likes, exponent, days, seed, chunk_size, **options):
+        self.rng = random.Random(seed)
+        self.exponent = exponent
+        self.chunk_size = chunk_size
+        self.now = timezone.now()
+        self.span = days * 86400
+        # フォローやいいねを「する」側 (activity) と「される」側 (popularity) で人気の順位を別々にする
+        self.activity = zipf_weights(users, exponent)
+        self.activity_order = self.rng.sample(range(users), users)
+        self.popularity_order = self.rng.sample(range(users), users)
+        self.popularity_rank = array("q", bytes(8 * users))
+        for rank, index in enumerate(self.popularity_order):
+            self.popularity_rank[index] = rank
+
+        with explicit_timestamps(FriendShip, Tweet):
+            self.timed("users", self.create_users, users, options["prefix"], options["password"])
+            self.timed("follows", self.create_follows, follows)
+            self.timed("tweets", self.create_tweets, tweets, likes)
+            self.timed("likes", self.create_likes)
+        if options["timelines"]:
+            self.timed("timeline", self.create_timelines)
+        self.stdout.write(self.style.SUCCESS("データを生成しました。"))
+
+    def timed(self, label, func, *args):
+        start = time.perf_counter()
+        created = func(*args)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label:<8} {created:>10} 件 {elapsed:>8.2f} s ({created / max(elapsed, 1e-9):>9.0f} 件/s)")
+
+    def random_time(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.span)
+
+    def bulk_create(self, model, objects):
+        created = 0
+        for batch in iter(lambda: list(islice(objects, self.chunk_size)), []):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            created += len(batch)
+        return created
+
+    def new_ids(self, model, last_id):
+        return array("q", model.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True))
+
+    def create_users(self, count, prefix, password):
+        last_id = User.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        # ハッシュ計算は重いので全員同じパスワードハッシュを使う
+        password = make_password(password)
+        usernames = (f"{prefix}{last_id + i + 1}" for i in range(count))
+        self.bulk_create(
+            User, (User(username=name, email=f"{name}@example.com", password=password) for name in usernames)
+        )
+        self.user_ids = self.new_ids(User, last_id)
+        return len(self.user_ids)
+
+    def create_follows(self, total):
+        user_ids = self.user_ids
+        n = len(user_ids)
+        popularity = zipf_weights(n, self.exponent)
+        out_degrees = distribute(self.rng, total, self.activity, cap=n - 1)
+        following_counts = array("q", bytes(8 * n))
+        followers_counts = array("q", bytes(8 * n))
+
+        def friendships():
+            for rank, degree in enumerate(out_degrees):
+                follower = self.activity_order[rank]
+                for followee_rank in sample_distinct(self.rng, popularity, degree, self.popularity_rank[follower]):
+                    followee = self.popularity_order[followee_rank]
+                    following_counts[follower] += 1
+                    followers_counts[followee] += 1
+                    yield FriendShip(
+                        follower_id=user_ids[follower], followee_id=user_ids[followee], created_at=self.random_time()
+                    )
+
+        created = self.bulk_create(FriendShip, friendships())
+        # bulk_create ではシグナルが送られないので、プロフィールは数え終わったフォロー数と一緒に作る
+        self.bulk_create(
+            UserProfile,
+            (
+                UserProfile(user_id=user_id, followers_count=followers_counts[i], following_count=following_counts[i])
+                for i, user_id in enumerate(user_ids)
+            ),
+        )
+        return created
+
+    def create_tweets(self, count, total_likes):
+        last_id = Tweet.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        # いいね数は先に決めておき、likes_count をツイートと一緒に書き込む。人気の順位は投稿順と無関係にする
+        by_rank = distribute(self.rng, total_likes, zipf_weights(count, self.exponent), cap=len(self.user_ids))
+        self.likes_counts = array("q", bytes(8 * count))
+        for rank, index in enumerate(self.rng.sample(range(count), count)):
+            self.likes_counts[index] = by_rank[rank]
+        authors = self.rng.choices(self.activity_order, cum_weights=self.activity, k=count)
+        created_at = sorted(self.random_time() for _ in range(count))
+        self.bulk_create(
+            Tweet,
+            (
+                Tweet(
+                    user_id=self.user_ids[authors[i]],
+                    content=" ".join(self.rng.choices(WORDS, k=5)),
+                    created_at=created_at[i],
+                    likes_count=self.likes_counts[i],
+                )
+                for i in range(count)
+            ),
+        )
+        self.tweet_ids = self.new_ids(Tweet, last_id)
+        return len(self.tweet_ids)
+
+    def create_likes(self):
+        def likes():
+            for i, tweet_id in enumerate(self.tweet_ids):
+                for rank in sample_distinct(self.rng, self.activity, self.likes_counts[i]):
+                    yield Like(likeuser_id=self.user_ids[self.activity_order[rank]], likedtweet_id=tweet_id)
+
+        return self.bulk_create(Like, likes())
+
+    def create_timelines(self):
+        call_command("rebuild_timelines", stdout=StringIO())
+        return TimelineEntry.objects.count()
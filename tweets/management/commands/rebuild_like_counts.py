@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from tweets.models import Like, Tweet
+
+
+class Command(BaseCommand):
+    help = "Like テーブルから Tweet.likes_count を再計算する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+
+    def handle(self, *args, chunk_size, **options):
+        counts = Like.objects.filter(likedtweet=OuterRef("pk")).values("likedtweet").annotate(c=Count("pk"))
+        last_id = Tweet.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        fixed = 0
+        for start in range(0, last_id + 1, chunk_size):
+            with transaction.atomic():
+                drifted = (
+                    Tweet.objects.filter(id__gte=start, id__lt=start + chunk_size)
+                    .annotate(actual=Coalesce(Subquery(counts.values("c")), 0))
+                    .exclude(likes_count=F("actual"))
+                    .only("id")
+                )
+                tweets = [Tweet(id=tweet.id, likes_count=tweet.actual) for tweet in drifted]
+                Tweet.objects.bulk_update(tweets, ["likes_count"])
+                Tweet.objects.filter(id__in=[tweet.id for tweet in tweets]).update(version=F("version") + 1)
+                fixed += len(tweets)
+        self.stdout.write(self.style.SUCCESS(f"{fixed} 件のいいね数を修正しました。"))
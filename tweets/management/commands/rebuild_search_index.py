@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tweets.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "ツイートの全文検索インデックス(SQLite FTS5)とトリガーを作り直す"
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("全文検索インデックスは SQLite でのみ利用できます。")
+        with connection.cursor() as cursor:
+            rebuild_search_index(cursor)
+        self.stdout.write(self.style.SUCCESS("検索インデックスを再構築しました。"))
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.timeline import rebuild_timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "フォロー関係と既存のツイートからホームタイムラインを作り直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, chunk_size, **options):
+        user_ids = User.objects.order_by("id").values_list("id", flat=True)
+        rebuilt = 0
+        for user_id in user_ids.iterator(chunk_size=chunk_size):
+            with transaction.atomic():
+                rebuild_timeline(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"{rebuilt} 人のタイムラインを再構築しました。"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tweets.trending import rebuild_trending
+
+
+class Command(BaseCommand):
+    help = (
+        "直近のツイートからトレンドを組み立て直して表示する。"
+        "トレンドは Web サーバーのプロセスごとにメモリ上で持つので、動いているサーバーのトレンドは変わらない"
+    )
+
+    def handle(self, *args, **options):
+        for name, terms in rebuild_trending().top().items():
+            self.stdout.write(f"{name}: " + ", ".join(f"#{term} ({count})" for term, count in terms))
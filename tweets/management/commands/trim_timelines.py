@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tweets.timeline import trim_timelines
+
+
+class Command(BaseCommand):
+    help = "TIMELINE_MAX_ENTRIES 件を超えたホームタイムラインの古いエントリを削除する。cron などで定期的に実行する"
+
+    def handle(self, *args, **options):
+        deleted = trim_timelines()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} 件のエントリを削除しました。"))
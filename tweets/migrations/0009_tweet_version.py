@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tweets", "0008_tweet_user_created_at_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:25
+
+from django.db import migrations
+
+# マイグレーションの時点の SQL をそのまま残す。tweets.search の FTS_SCHEMA を変えてもここは変わらない
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tweets_tweet_fts USING fts5(
+        content, content='tweets_tweet', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_ai AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_ad AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_au AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO tweets_tweet_fts(tweets_tweet_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_ai",
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_ad",
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_au",
+    "DROP TABLE IF EXISTS tweets_tweet_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in CREATE_SEARCH_INDEX:
+            cursor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_SEARCH_INDEX:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tweets", "0009_tweet_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
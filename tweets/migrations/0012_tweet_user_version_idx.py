@@ -0,0 +1,16 @@
+# Generated by Django 4.1.13 on 2026-10-18 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tweets", "0011_hashtag_mention_tweettag"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["user", "version"], name="tweet_user_version_idx"),
+        ),
+    ]
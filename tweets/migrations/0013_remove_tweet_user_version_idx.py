@@ -0,0 +1,16 @@
+# Generated by Django 4.1.13 on 2026-10-18 03:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tweets", "0012_tweet_user_version_idx"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="tweet",
+            name="tweet_user_version_idx",
+        ),
+    ]
@@ -6,9 +6,15 @@ class Tweet(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField(max_length=280)
     created_at = models.DateTimeField(auto_now_add=True)
+    likes_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_at_id_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_at_idx"),
+        ]
 
 
 class Like(models.Model):
@@ -17,3 +23,40 @@ class Like(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["likeuser", "likedtweet"], name="unique_like")]
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry")]
+        indexes = [models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx")]
+
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class TweetTag(models.Model):
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="tags")
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="tweet_tags")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["tweet", "hashtag"], name="unique_tweet_tag")]
+        indexes = [models.Index(fields=["hashtag", "-created_at", "-tweet"], name="tweettag_hashtag_created_idx")]
+
+
+class Mention(models.Model):
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="mentions")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="mentions")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["tweet", "user"], name="unique_mention")]
+        indexes = [models.Index(fields=["user", "-created_at", "-tweet"], name="mention_user_created_idx")]
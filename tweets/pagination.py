@@ -0,0 +1,160 @@
+import base64
+import binascii
+import json
+import math
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+NEXT = "n"
+PREVIOUS = "p"
+MAX_ID = 2**63 - 1
+
+
+def decode_value(field, value):
+    """
+    カーソルの値をフィールドに合わせて検証する。不正な値は None を返す。
+    範囲外の id などをそのままデータベースに渡すと OverflowError などで 500 になる
+    """
+    if isinstance(value, bool):
+        return None
+    if field == "id" or field.endswith("_id"):
+        # BigAutoField に入る範囲
+        return value if isinstance(value, int) and 0 < value <= MAX_ID else None
+    if field.endswith("_at"):
+        if not isinstance(value, str):
+            return None
+        try:
+            return parse_datetime(value)
+        except ValueError:
+            return None
+    return value if isinstance(value, (int, float)) and math.isfinite(value) else None
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    """
+    (created_at, id) のような降順のキーでページングする。
+    OFFSET も COUNT(*) も使わないので、何ページ目でもコストは変わらない。
+    """
+
+    def __init__(self, page_size=20, fields=("created_at", "id")):
+        self.page_size = page_size
+        self.fields = tuple(fields)
+
+    def encode(self, obj, direction):
+        # DjangoJSONEncoder はマイクロ秒を切り捨てるので isoformat() をそのまま使う
+        values = [getattr(obj, field) for field in self.fields]
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+        raw = json.dumps([direction, *values], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            direction, *values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise Http404("不正なカーソルです。")
+        if direction not in (NEXT, PREVIOUS) or len(values) != len(self.fields):
+            raise Http404("不正なカーソルです。")
+        values = [decode_value(field, value) for field, value in zip(self.fields, values)]
+        if None in values:
+            raise Http404("不正なカーソルです。")
+        return direction, values
+
+    def keyset(self, direction, values):
+        lookup = "lt" if direction == NEXT else "gt"
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            equal = dict(zip(self.fields[:i], values[:i]))
+            condition |= Q(**equal, **{f"{field}__{lookup}": values[i]})
+        return condition
+
+    def ordering(self, direction):
+        prefix = "-" if direction == NEXT else ""
+        return [prefix + field for field in self.fields]
+
+    def apply(self, queryset, direction, values):
+        if values is not None:
+            queryset = queryset.filter(self.keyset(direction, values))
+        return queryset.order_by(*self.ordering(direction))
+
+    def filter(self, queryset, cursor):
+        direction, values = self.decode(cursor) if cursor else (NEXT, None)
+        return direction, self.apply(queryset, direction, values)
+
+    def page(self, rows, direction, has_cursor):
+        """
+        先頭から page_size + 1 件取得した rows からページを組み立てる。
+        PREVIOUS 方向の rows は昇順で渡されるので、ここで降順に直す。
+        """
+        rows = list(rows)
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if direction == PREVIOUS:
+            rows.reverse()
+            has_next, has_previous = has_cursor, has_more
+        else:
+            has_next, has_previous = has_more, has_cursor
+        if not rows:
+            return CursorPage(rows)
+        return CursorPage(
+            rows,
+            next_cursor=self.encode(rows[-1], NEXT) if has_next else None,
+            previous_cursor=self.encode(rows[0], PREVIOUS) if has_previous else None,
+        )
+
+    def paginate(self, queryset, cursor):
+        direction, queryset = self.filter(queryset, cursor)
+        return self.page(queryset[: self.page_size + 1], direction, bool(cursor))
+
+
+class CursorPaginationMixin:
+    page_size = 20
+    cursor_fields = ("created_at", "id")
+    cursor_param = "cursor"
+
+    def get_cursor_paginator(self):
+        return CursorPaginator(self.page_size, self.cursor_fields)
+
+    def get_cursor(self):
+        return self.request.GET.get(self.cursor_param)
+
+    def paginate_by_cursor(self, queryset):
+        return self.get_cursor_paginator().paginate(queryset, self.get_cursor())
+
+    def get_context_data(self, **kwargs):
+        page = self.paginate_by_cursor(self.object_list)
+        kwargs["object_list"] = page.object_list
+        context = super().get_context_data(**kwargs)
+        context["page"] = page
+        return context
+
+
+def paginate_tweet_entries(entries, cursor, page_size):
+    """
+    (created_at, tweet) を持つ索引テーブル(タイムライン・ハッシュタグ・メンション)を範囲読み込みし、
+    Tweet の (created_at, id) と互換のカーソルでツイートのページを返す。
+    """
+    direction, entries = CursorPaginator(page_size, ("created_at", "tweet_id")).filter(entries, cursor)
+    entries = entries.select_related("tweet__user")[: page_size + 1]
+    return CursorPaginator(page_size).page([entry.tweet for entry in entries], direction, bool(cursor))
@@ -0,0 +1,126 @@
+from django.db import connections, router
+
+from tweets.models import Tweet
+from tweets.pagination import NEXT, CursorPage, CursorPaginator
+
+FTS_TABLE = "tweets_tweet_fts"
+FTS_TRIGGERS = [f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au"]
+
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='tweets_tweet', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+# trigram トークナイザは 3 文字未満の語にマッチしないので、短い語は LIKE で絞り込む
+MIN_TERM_LENGTH = 3
+
+
+def rebuild_search_index(cursor):
+    for sql in FTS_SCHEMA:
+        cursor.execute(sql)
+    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(cursor):
+    for trigger in FTS_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def restore_search_triggers(connection):
+    """
+    SQLite はテーブルを作り直すマイグレーションで tweets_tweet のトリガーを落とすので、
+    マイグレーションの後に足りないトリガーを張り直し、その間に漏れた分を含めてインデックスを作り直す。
+    検索インデックスを作るマイグレーションがまだ適用されていなければ何もしない。
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        if FTS_TABLE not in connection.introspection.table_names(cursor):
+            return
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'tweets_tweet'")
+        if set(FTS_TRIGGERS) <= {name for name, in cursor.fetchall()}:
+            return
+        rebuild_search_index(cursor)
+
+
+def build_match_query(terms):
+    """
+    入力を FTS5 の構文として解釈させないよう語ごとに引用符で囲み、最後の語は前方一致にする。
+    """
+    quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_recent_tweets(terms, cursor, page_size):
+    """すべての語が短く FTS で引けないときは、すべての語を含むツイートを新しい順に LIKE で探す"""
+    tweets = Tweet.objects.select_related("user")
+    for term in terms:
+        tweets = tweets.filter(content__contains=term)
+    return CursorPaginator(page_size).paginate(tweets, cursor)
+
+
+def search_tweets(query, cursor, page_size):
+    """
+    bm25 のスコア順(同点は id の降順)で 1 ページ分のツイートを返す。各ツイートには search_score が付く。
+    3 文字未満の語は FTS の結果を LIKE で絞り込み、短い語しかなければ search_recent_tweets で新しい順に返す。
+    """
+    terms = query.split()
+    if not terms:
+        return CursorPage([])
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    if not long_terms:
+        return search_recent_tweets(short_terms, cursor, page_size)
+    paginator = CursorPaginator(page_size, ("search_score", "id"))
+    direction, values = paginator.decode(cursor) if cursor else (NEXT, None)
+
+    # bm25() は小さいほど関連度が高いので符号を反転して降順のキーにする
+    score = f"-bm25({FTS_TABLE})"
+    sql = f"SELECT rowid, {score} AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [build_match_query(long_terms)]
+    for term in short_terms:
+        sql += " AND content LIKE %s ESCAPE '\\'"
+        params.append(like_pattern(term))
+    if values is not None:
+        op = "<" if direction == NEXT else ">"
+        sql += f" AND ({score} {op} %s OR ({score} = %s AND rowid {op} %s))"
+        params += [values[0], values[0], values[1]]
+    order = "DESC" if direction == NEXT else "ASC"
+    sql += f" ORDER BY score {order}, rowid {order} LIMIT %s"
+    params.append(page_size + 1)
+
+    with connections[router.db_for_read(Tweet)].cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        scores = dict(db_cursor.fetchall())
+    tweets = Tweet.objects.select_related("user").in_bulk(scores)
+    rows = []
+    for tweet_id, score in scores.items():
+        if tweet_id in tweets:
+            tweets[tweet_id].search_score = score
+            rows.append(tweets[tweet_id])
+    return paginator.page(rows, direction, bool(cursor))
@@ -0,0 +1,47 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from accounts.models import FriendShip
+from tweets.fragments import invalidate_tweet
+from tweets.likes import likes_changed
+from tweets.live import live_hub, notify_new_tweet
+from tweets.models import Tweet
+from tweets.search import restore_search_triggers
+from tweets.timeline import backfill_timeline, fan_out_tweet, purge_timeline
+from tweets.trending import record_tweet
+
+
+@receiver(post_save, sender=Tweet)
+def fan_out_created_tweet(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        fan_out_tweet(instance)
+        record_tweet(instance)
+        transaction.on_commit(lambda: notify_new_tweet(instance))
+
+
+@receiver(post_delete, sender=Tweet)
+def invalidate_deleted_tweet(sender, instance, **kwargs):
+    invalidate_tweet(instance)
+
+
+@receiver(post_save, sender=FriendShip)
+def backfill_followed_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        backfill_timeline(instance.follower_id, instance.followee_id)
+
+
+@receiver(post_delete, sender=FriendShip)
+def purge_unfollowed_timeline(sender, instance, **kwargs):
+    purge_timeline(instance.follower_id, instance.followee_id)
+
+
+@receiver(likes_changed)
+def push_like_counts(sender, counts, **kwargs):
+    live_hub.publish_like_counts(counts)
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    if sender.name == "tweets":
+        restore_search_triggers(connections[using])
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+STREAM_ROWS_PLACEHOLDER = "<!--stream-rows-->"
+
+
+class StreamingTemplateMixin:
+    """
+    STREAMING_RESPONSES が有効なとき、ページを「ヘッダー / 1 行ずつ / フッター」に分けて
+    StreamingHttpResponse で返す。行はカーソルページングで page_size 件までに絞られたリストで、
+    ReplicaReadMixin の振り分けが効く dispatch の中で読み込み済みなので、本文を返している間は描画だけを行う。
+    """
+
+    stream_row_template_name = None
+    stream_row_context_name = "object"
+
+    def should_stream(self):
+        return getattr(settings, "STREAMING_RESPONSES", False)
+
+    def get_stream_row_context(self, engine):
+        # コンテキストプロセッサは行ごとではなく 1 回だけ実行する
+        context = Context(autoescape=engine.autoescape)
+        for processor in engine.template_context_processors:
+            context.update(processor(self.request))
+        return context
+
+    def stream(self, head, rows, tail, row_template, context):
+        yield head
+        for row in rows:
+            with context.push({self.stream_row_context_name: row}):
+                yield row_template.render(context)
+        yield tail
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.should_stream():
+            return super().render_to_response(context, **response_kwargs)
+        rows = context["object_list"]
+        context["object_list"] = context[self.context_object_name] = []
+        context["stream_rows"] = mark_safe(STREAM_ROWS_PLACEHOLDER)
+        html = get_template(self.get_template_names()[0]).render(context, self.request)
+        head, tail = html.split(STREAM_ROWS_PLACEHOLDER, 1)
+        row_template = get_template(self.stream_row_template_name).template
+        row_context = self.get_stream_row_context(row_template.engine)
+        return StreamingHttpResponse(
+            self.stream(head, rows, tail, row_template, row_context), content_type="text/html; charset=utf-8"
+        )
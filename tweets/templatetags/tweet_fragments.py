@@ -0,0 +1,10 @@
+from django import template
+
+from tweets.fragments import render_tweet as render_tweet_fragment
+
+register = template.Library()
+
+
+@register.simple_tag
+def render_tweet(tweet, template_name):
+    return render_tweet_fragment(tweet, template_name)
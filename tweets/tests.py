@@ -1,13 +1,43 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.http import Http404
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
 
-from accounts.models import User
+from accounts.models import FriendShip, User
 
-from .models import Like, Tweet
+from .cache import liked_tweet_cache
+from .entities import extract_hashtags, extract_mentions
+from .fragments import fragment_key, render_tweet
+from .likes import add_like, apply_like_operations, likes_changed, remove_like
+from .live import LiveHub, live_application
+from .models import Like, Mention, TimelineEntry, Tweet, TweetTag
+from .search import search_tweets
+from .trending import TrendingTopics, rebuild_trending, reset_trending
+from .views import AsyncTweetDetailView, TweetDetailView
+from .write_behind import LikeBuffer
 
 
 class TestHomeView(TestCase):
     def setUp(self):
+        caches["likes"].clear()
         self.url = reverse("tweets:home")
         self.user = User.objects.create_user(username="tester", password="password")
         self.client.force_login(self.user)
@@ -24,6 +54,204 @@ class TestHomeView(TestCase):
         self.assertTemplateUsed(response, "tweets/home.html")
         self.assertQuerysetEqual(response.context["tweets"], tweets_in_db)
 
+    def test_success_get_with_cursor(self):
+        for i in range(25):
+            Tweet.objects.create(content=f"tweet {i}", user=self.user)
+        tweets_in_db = list(Tweet.objects.order_by("-created_at", "-id"))
+
+        response = self.client.get(self.url)
+        first_page = response.context["page"]
+        self.assertEqual(list(response.context["tweets"]), tweets_in_db[:20])
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+
+        response = self.client.get(self.url, {"cursor": first_page.next_cursor})
+        second_page = response.context["page"]
+        self.assertEqual(list(response.context["tweets"]), tweets_in_db[20:])
+        self.assertFalse(second_page.has_next())
+
+        response = self.client.get(self.url, {"cursor": second_page.previous_cursor})
+        self.assertEqual(list(response.context["tweets"]), tweets_in_db[:20])
+
+    def test_success_get_with_liked_state(self):
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        response = self.client.get(self.url)
+        liked = {tweet.id: tweet.is_liked for tweet in response.context["tweets"]}
+        self.assertTrue(liked.pop(self.tweet.id))
+        self.assertFalse(any(liked.values()))
+
+    @override_settings(STREAMING_RESPONSES=True)
+    def test_success_get_with_streaming(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        # 読み込みはビューの中で済ませ、本文を返している間はクエリを発行しない
+        with self.assertNumQueries(0):
+            content = b"".join(response.streaming_content).decode()
+        for tweet in Tweet.objects.all():
+            self.assertIn(reverse("tweets:detail", kwargs={"pk": tweet.pk}), content)
+        self.assertTrue(content.rstrip().endswith("</html>"))
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_failure_get_with_out_of_range_cursor(self):
+        now = timezone.now().isoformat()
+        for values in [[now, 2**70], [now, 0], [now, now], [1e308, 1], [now, 1.5], ["2024-13-45T00:00:00", 1]]:
+            raw = json.dumps(["n", *values]).encode()
+            cursor = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404, values)
+
+
+class TestHomeTimeline(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.url = reverse("tweets:home")
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.followee = User.objects.create_user(username="followee", password="password")
+        self.stranger = User.objects.create_user(username="stranger", password="password")
+        FriendShip.objects.create(follower=self.user, followee=self.followee)
+        self.client.force_login(self.user)
+
+    def test_followee_tweet_is_fanned_out(self):
+        followee_tweet = Tweet.objects.create(content="followee", user=self.followee)
+        Tweet.objects.create(content="stranger", user=self.stranger)
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["tweets"]), [followee_tweet])
+
+    def test_follow_backfills_timeline(self):
+        stranger_tweet = Tweet.objects.create(content="stranger", user=self.stranger)
+        FriendShip.objects.create(follower=self.user, followee=self.stranger)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=stranger_tweet).exists())
+
+    def test_unfollow_purges_timeline(self):
+        Tweet.objects.create(content="followee", user=self.followee)
+        FriendShip.objects.filter(follower=self.user, followee=self.followee).delete()
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_timeline_is_capped(self):
+        tweets = [Tweet.objects.create(content=f"tweet {i}", user=self.followee) for i in range(5)]
+        entries = TimelineEntry.objects.filter(owner=self.user).order_by("-created_at")
+        # ファンアウトでは切り詰めず、trim_timelines コマンドで上限を超えたタイムラインだけを切り詰める
+        self.assertEqual(entries.count(), 5)
+        with CaptureQueriesContext(connection) as queries:
+            call_command("trim_timelines", stdout=StringIO())
+        self.assertEqual([entry.tweet for entry in entries], tweets[:1:-1])
+        [delete] = [query["sql"] for query in queries if query["sql"].startswith("DELETE")]
+        self.assertIn(f'"owner_id" IN ({self.user.id}, {self.followee.id})', delete)
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_follow_backfill_is_capped(self):
+        tweets = [Tweet.objects.create(content=f"stranger {i}", user=self.stranger) for i in range(5)]
+        FriendShip.objects.create(follower=self.user, followee=self.stranger)
+        entries = TimelineEntry.objects.filter(owner=self.user).order_by("-created_at")
+        self.assertEqual([entry.tweet for entry in entries], tweets[:1:-1])
+
+    @override_settings(TIMELINE_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_high_follower_tweets_are_merged_on_read(self):
+        followee_tweets = [Tweet.objects.create(content=f"followee {i}", user=self.followee) for i in range(15)]
+        own_tweets = [Tweet.objects.create(content=f"own {i}", user=self.user) for i in range(15)]
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user, tweet__user=self.followee).exists())
+        expected = sorted(followee_tweets + own_tweets, key=lambda tweet: (tweet.created_at, tweet.id), reverse=True)
+
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["tweets"]), expected[:20])
+        next_cursor = response.context["page"].next_cursor
+        response = self.client.get(self.url, {"cursor": next_cursor})
+        self.assertEqual(list(response.context["tweets"]), expected[20:])
+        previous_cursor = response.context["page"].previous_cursor
+        response = self.client.get(self.url, {"cursor": previous_cursor})
+        self.assertEqual(list(response.context["tweets"]), expected[:20])
+
+    def test_rebuild_timelines(self):
+        tweet = Tweet.objects.create(content="followee", user=self.followee)
+        TimelineEntry.objects.all().delete()
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.followee, tweet=tweet).exists())
+
+
+class TestTweetSearchView(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.url = reverse("tweets:search")
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.client.force_login(self.user)
+        self.match = Tweet.objects.create(content="今日はいい天気ですね", user=self.user)
+        self.strong_match = Tweet.objects.create(content="いい天気 いい天気 いい天気", user=self.user)
+        Tweet.objects.create(content="明日は雨です", user=self.user)
+
+    def test_success_get(self):
+        response = self.client.get(self.url, {"q": "天気です"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweets"]), [self.match])
+
+    def test_success_get_ranked(self):
+        response = self.client.get(self.url, {"q": "い天気"})
+        self.assertEqual(list(response.context["tweets"]), [self.strong_match, self.match])
+
+    def test_success_get_with_short_term(self):
+        # 3 文字未満の語しかなければ LIKE で新しい順に探す
+        response = self.client.get(self.url, {"q": "天気"})
+        self.assertEqual(list(response.context["tweets"]), [self.strong_match, self.match])
+        response = self.client.get(self.url, {"q": "天気 今日"})
+        self.assertEqual(list(response.context["tweets"]), [self.match])
+        response = self.client.get(self.url, {"q": "%"})
+        self.assertEqual(list(response.context["tweets"]), [])
+
+    def test_success_get_with_long_and_short_terms(self):
+        response = self.client.get(self.url, {"q": "いい天気 今日"})
+        self.assertEqual(list(response.context["tweets"]), [self.match])
+        response = self.client.get(self.url, {"q": "いい天気 _"})
+        self.assertEqual(list(response.context["tweets"]), [])
+
+    def test_success_get_with_prefix_and_cursor(self):
+        for i in range(25):
+            Tweet.objects.create(content=f"searchable tweet {i}", user=self.user)
+        response = self.client.get(self.url, {"q": "searcha"})
+        first_page = list(response.context["tweets"])
+        self.assertEqual(len(first_page), 20)
+        response = self.client.get(self.url, {"q": "searcha", "cursor": response.context["page"].next_cursor})
+        second_page = list(response.context["tweets"])
+        self.assertEqual(len(second_page), 5)
+        self.assertFalse(set(first_page) & set(second_page))
+
+    def test_success_get_with_updated_and_deleted_tweet(self):
+        self.match.content = "曇り"
+        self.match.save()
+        self.strong_match.delete()
+        response = self.client.get(self.url, {"q": "い天気"})
+        self.assertEqual(list(response.context["tweets"]), [])
+
+    def test_success_get_with_quotes(self):
+        response = self.client.get(self.url, {"q": 'AND "OR NEAR('})
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_search_index(self):
+        call_command("rebuild_search_index", stdout=StringIO())
+        response = self.client.get(self.url, {"q": "い天気"})
+        self.assertEqual(len(response.context["tweets"]), 2)
+
+
+class TestSearchIndexAfterTableRebuild(TransactionTestCase):
+    def test_triggers_are_restored_after_migrate(self):
+        user = User.objects.create_user(username="tester", password="password")
+        Tweet.objects.create(content="作り直す前のツイート", user=user)
+        # SQLite で列を変更するマイグレーションと同じようにテーブルを作り直すと、トリガーが消える
+        with connection.schema_editor() as editor:
+            editor._remake_table(Tweet)
+        tweet = Tweet.objects.create(content="作り直した後のツイート", user=user)
+        self.assertEqual(search_tweets("した後の", None, 20).object_list, [])
+
+        call_command("migrate", verbosity=0)
+        self.assertEqual(search_tweets("した後の", None, 20).object_list, [tweet])
+        tweet.content = "書き換えたツイート"
+        tweet.save()
+        self.assertEqual(search_tweets("した後の", None, 20).object_list, [])
+        self.assertEqual(len(search_tweets("ツイート", None, 20).object_list), 2)
+
 
 class TestTweetCreateView(TestCase):
     def setUp(self):
@@ -68,6 +296,7 @@ class TestTweetCreateView(TestCase):
 
 class TestTweetDetailView(TestCase):
     def setUp(self):
+        caches["likes"].clear()
         self.user = User.objects.create_user(username="tester", password="testpassword")
         self.client.force_login(self.user)
         self.tweet = Tweet.objects.create(content="test", user=self.user)
@@ -78,6 +307,12 @@ class TestTweetDetailView(TestCase):
         self.assertTemplateUsed(response, "tweets/tweet_detail.html")
         tweets_in_context = response.context["tweet"]
         self.assertEqual(tweets_in_context, self.tweet)
+        self.assertFalse(tweets_in_context.is_liked)
+
+    def test_success_get_with_liked_tweet(self):
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        response = self.client.get(f"/tweets/{self.tweet.id}/")
+        self.assertTrue(response.context["tweet"].is_liked)
 
 
 class TestTweetDeleteView(TestCase):
@@ -123,6 +358,9 @@ class TestLikeView(TestCase):
         self.assertEqual(response.status_code, 200)
         updated_likes_count = Like.objects.count()
         self.assertEqual(updated_likes_count, initial_likes_count + 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(response.json()["likes_count"], 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         initial_likes_count = Like.objects.count()
@@ -138,6 +376,8 @@ class TestLikeView(TestCase):
         self.assertEqual(response.status_code, 200)
         updated_likes_count = Like.objects.count()
         self.assertEqual(updated_likes_count, initial_likes_count)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
 
 
 class TestUnLikeView(TestCase):
@@ -145,6 +385,7 @@ class TestUnLikeView(TestCase):
         self.user = User.objects.create_user(username="testuser", password="testpassword")
         self.tweet = Tweet.objects.create(user=self.user, content="Test tweet")
         Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        Tweet.objects.filter(pk=self.tweet.pk).update(likes_count=1)
         self.client.login(username="testuser", password="testpassword")
 
     def test_success_post(self):
@@ -153,6 +394,9 @@ class TestUnLikeView(TestCase):
         self.assertEqual(response.status_code, 200)
         updated_likes_count = Like.objects.count()
         self.assertEqual(updated_likes_count, initial_likes_count - 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual(response.json()["likes_count"], 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         initial_likes_count = Like.objects.count()
@@ -163,5 +407,659 @@ class TestUnLikeView(TestCase):
 
     def test_failure_post_with_unliked_tweet(self):
         Like.objects.filter(likeuser=self.user, likedtweet=self.tweet).delete()
+        Tweet.objects.filter(pk=self.tweet.pk).update(likes_count=0)
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.id}))
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["likes_count"], 0)
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.url = reverse("tweets:like_batch")
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(3)]
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweets[2])
+        Tweet.objects.filter(pk=self.tweets[2].pk).update(likes_count=1)
+        self.client.force_login(self.user)
+
+    def post(self, operations):
+        return self.client.post(self.url, {"operations": operations}, content_type="application/json")
+
+    def test_success_post(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweets[0].id, "action": "like"},
+                {"tweet_id": self.tweets[1].id, "action": "like"},
+                {"tweet_id": self.tweets[1].id, "action": "unlike"},
+                {"tweet_id": self.tweets[2].id, "action": "unlike"},
+                {"tweet_id": 9999, "action": "like"},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = {result["tweet_id"]: result for result in response.json()["results"]}
+        self.assertEqual(set(results), {tweet.id for tweet in self.tweets})
+        self.assertEqual(results[self.tweets[0].id], {"tweet_id": self.tweets[0].id, "liked": True, "likes_count": 1})
+        self.assertEqual(results[self.tweets[1].id]["likes_count"], 0)
+        self.assertEqual(results[self.tweets[2].id]["likes_count"], 0)
+        self.assertEqual(list(Like.objects.values_list("likedtweet_id", flat=True)), [self.tweets[0].id])
+
+    def test_success_post_with_liked_tweet(self):
+        response = self.post([{"tweet_id": self.tweets[2].id, "action": "like"}])
+        self.assertEqual(response.json()["results"][0]["likes_count"], 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_post_with_invalid_action(self):
+        response = self.post([{"tweet_id": self.tweets[0].id, "action": "retweet"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_post_with_too_many_operations(self):
+        response = self.post([{"tweet_id": self.tweets[0].id, "action": "like"}] * 101)
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_post_with_out_of_range_tweet_id(self):
+        for tweet_id in (2**63, 0, -1):
+            response = self.post([{"tweet_id": tweet_id, "action": "like"}])
+            self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_like_is_not_counted_twice(self):
+        # 読み込みの後、書き込みの前に同じいいねが並行して反映された状況を再現する
+        add_like(self.user, self.tweets[0])
+        remove_like(self.user, self.tweets[2])
+        received = []
+
+        def receiver(counts, **kwargs):
+            received.append(counts)
+
+        likes_changed.connect(receiver)
+        self.addCleanup(likes_changed.disconnect, receiver)
+        stale = {self.tweets[2].id}
+        with mock.patch("tweets.likes._liked_tweet_ids", return_value=stale):
+            with self.captureOnCommitCallbacks(execute=True):
+                likes_counts = apply_like_operations(
+                    self.user.id, [(self.tweets[0].id, True), (self.tweets[1].id, True), (self.tweets[2].id, False)]
+                )
+        self.assertEqual(likes_counts, {self.tweets[0].id: 1, self.tweets[1].id: 1, self.tweets[2].id: 0})
+        self.assertEqual(received, [{self.tweets[1].id: (1, 1)}])
+
+
+class TestLikeBuffer(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(2)]
+        self.journal_dir = Path(tempfile.mkdtemp())
+        self.buffer = self.create_buffer()
+
+    def create_buffer(self):
+        buffer = LikeBuffer(self.journal_dir, apply=apply_like_operations)
+        buffer.start(background=False)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def crash(self, buffer):
+        # フラッシュせずにジャーナルのロックだけを外す
+        buffer._pending = {}
+        buffer._journal.close()
+        buffer._journal = None
+
+    def test_enqueue_is_coalesced_and_overlaid(self):
+        self.buffer.enqueue(self.user.id, self.tweets[0].id, True)
+        self.buffer.enqueue(self.user.id, self.tweets[1].id, True)
+        self.buffer.enqueue(self.user.id, self.tweets[1].id, False)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(self.buffer.liked_overlay(self.user.id), {self.tweets[0].id: True, self.tweets[1].id: False})
+        deltas = self.buffer.count_deltas([tweet.id for tweet in self.tweets])
+        self.assertEqual((deltas[self.tweets[0].id], deltas[self.tweets[1].id]), (1, 0))
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(list(Like.objects.values_list("likedtweet_id", flat=True)), [self.tweets[0].id])
+        self.assertEqual(Tweet.objects.get(pk=self.tweets[0].pk).likes_count, 1)
+        self.assertEqual(self.buffer.liked_overlay(self.user.id), {})
+        self.assertEqual(self.buffer.journal_path.read_text(), "")
+
+    def test_journal_is_per_process(self):
+        self.buffer.enqueue(self.user.id, self.tweets[0].id, True)
+        other = self.create_buffer()
+        other.enqueue(self.user.id, self.tweets[1].id, True)
+        other.flush()
+        # 生きているプロセスのジャーナルは引き取らず、他のプロセスの書き換えで消えることもない
+        self.assertEqual(other.liked_overlay(self.user.id), {})
+        self.assertEqual(self.buffer.journal_path.read_text(), f"[{self.user.id}, {self.tweets[0].id}, 1]\n")
+
+    def test_orphaned_journal_is_claimed_once(self):
+        self.buffer.enqueue(self.user.id, self.tweets[0].id, True)
+        self.crash(self.buffer)
+        claimer = self.create_buffer()
+        self.assertFalse(self.buffer.journal_path.exists())
+        self.assertEqual(claimer.liked_overlay(self.user.id), {self.tweets[0].id: True})
+        self.assertEqual(self.create_buffer().liked_overlay(self.user.id), {})
+        claimer.flush()
+        self.assertTrue(Like.objects.filter(likeuser=self.user, likedtweet=self.tweets[0]).exists())
+
+    def test_like_view_uses_buffer(self):
+        self.client.force_login(self.user)
+        with override_settings(LIKE_WRITE_BEHIND=True), mock.patch("tweets.likes._like_buffer", self.buffer):
+            response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].id}))
+            self.assertEqual(response.json()["likes_count"], 1)
+            self.assertFalse(Like.objects.exists())
+            response = self.client.get(reverse("tweets:home"))
+            liked = {tweet.id: tweet.is_liked for tweet in response.context["tweets"]}
+            self.assertTrue(liked[self.tweets[0].id])
+
+    def test_batch_view_uses_buffer(self):
+        self.client.force_login(self.user)
+        with override_settings(LIKE_WRITE_BEHIND=True), mock.patch("tweets.likes._like_buffer", self.buffer):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].id}))
+            response = self.client.post(
+                reverse("tweets:like_batch"),
+                {"operations": [{"tweet_id": self.tweets[0].id, "action": "unlike"}]},
+                content_type="application/json",
+            )
+        self.assertEqual(
+            response.json()["results"], [{"tweet_id": self.tweets[0].id, "liked": False, "likes_count": 0}]
+        )
+        # 後から積んだ取り消しが先のいいねを上書きするので、フラッシュしてもいいねは残らない
+        self.buffer.flush()
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(Tweet.objects.get(pk=self.tweets[0].pk).likes_count, 0)
+
+
+class TestLikeBufferDeadLetter(TransactionTestCase):
+    def test_events_that_cannot_apply_are_dead_lettered(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        deleted = User.objects.create_user(username="deleted", password="testpassword")
+        tweet = Tweet.objects.create(user=user, content="tweet")
+        buffer = LikeBuffer(Path(tempfile.mkdtemp()), apply=apply_like_operations)
+        buffer.start(background=False)
+        self.addCleanup(buffer.close)
+        buffer.enqueue(user.id, tweet.id, True)
+        buffer.enqueue(deleted.id, tweet.id, True)
+        # 削除されたユーザーのイベントは外部キー制約で二度と書き込めない
+        deleted_id = deleted.id
+        deleted.delete()
+
+        with self.assertLogs("tweets.write_behind", "WARNING"):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(list(Like.objects.values_list("likeuser_id", flat=True)), [user.id])
+        dead_letter = buffer.journal_dir / "dead_letter.jsonl"
+        self.assertEqual(dead_letter.read_text(), f"[{deleted_id}, {tweet.id}, 1]\n")
+        self.assertEqual(buffer.flush(), 0)
+
+
+class TestRebuildLikeCountsCommand(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other_user = User.objects.create_user(username="otheruser", password="otherpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="Test tweet")
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        Like.objects.create(likeuser=self.other_user, likedtweet=self.tweet)
+
+    def test_rebuild(self):
+        Tweet.objects.filter(pk=self.tweet.pk).update(likes_count=5)
+        call_command("rebuild_like_counts", stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+
+
+class TestLikedTweetCache(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(3)]
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweets[0])
+        self.client.force_login(self.user)
+
+    def test_get_counts_hits_and_misses(self):
+        before = liked_tweet_cache.stats()
+        ids = liked_tweet_cache.get(self.user.id)
+        self.assertEqual(list(ids), [self.tweets[0].id])
+        liked_tweet_cache.get(self.user.id)
+        after = liked_tweet_cache.stats()
+        self.assertEqual(after["misses"], before["misses"] + 1)
+        self.assertEqual(after["hits"], before["hits"] + 1)
+
+    def test_like_and_unlike_write_through(self):
+        liked_tweet_cache.get(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[2].id}))
+        with self.assertNumQueries(0):
+            self.assertEqual(list(liked_tweet_cache.get(self.user.id)), [self.tweets[0].id, self.tweets[2].id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[1].id}))
+            self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweets[0].id}))
+        with self.assertNumQueries(0):
+            self.assertEqual(list(liked_tweet_cache.get(self.user.id)), [self.tweets[1].id, self.tweets[2].id])
+
+    def test_update_is_skipped_after_concurrent_write(self):
+        liked_tweet_cache.get(self.user.id)
+        # 他のプロセスの書き込みで版が進み、その差分はこのキャッシュにまだ当たっていない
+        caches["likes"].incr(liked_tweet_cache.version_key(self.user.id))
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweets[1])
+        liked_tweet_cache.update(self.user.id, {self.tweets[2].id: True})
+        with self.assertNumQueries(1):
+            ids = liked_tweet_cache.get(self.user.id)
+        self.assertEqual(list(ids), [self.tweets[0].id, self.tweets[1].id])
+
+    def test_stats_view_requires_staff(self):
+        response = self.client.get(reverse("tweets:liked_cache_stats"))
+        self.assertEqual(response.status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("tweets:liked_cache_stats"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"hits", "misses", "hit_ratio"})
+
+
+class TestTweetFragmentCache(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        caches["fragments"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="Test tweet")
+        self.client.force_login(self.user)
+
+    def test_fragment_is_rendered_once(self):
+        with mock.patch("tweets.fragments.render_to_string", wraps=render_to_string) as render:
+            self.client.get(reverse("tweets:home"))
+            self.client.get(reverse("tweets:home"))
+        self.assertEqual(render.call_count, 1)
+
+    def test_liked_state_is_patched_per_viewer(self):
+        self.tweet.is_liked = True
+        self.assertIn("いいね取り消し", render_tweet(self.tweet, "tweets/tweet_item.html"))
+        self.tweet.is_liked = False
+        html = render_tweet(self.tweet, "tweets/tweet_item.html")
+        self.assertNotIn("いいね取り消し", html)
+        self.assertIn(reverse("tweets:like", kwargs={"pk": self.tweet.id}), html)
+
+    def test_like_bumps_version(self):
+        old_key = fragment_key("tweets/tweet_item.html", self.tweet)
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.id}))
+        self.tweet.refresh_from_db()
+        self.assertNotEqual(fragment_key("tweets/tweet_item.html", self.tweet), old_key)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, "1いいね")
+
+    def test_delete_invalidates_fragment(self):
+        render_tweet(self.tweet, "tweets/tweet_item.html")
+        key = fragment_key("tweets/tweet_item.html", self.tweet)
+        self.assertIsNotNone(caches["fragments"].get(key))
+        self.tweet.delete()
+        self.assertIsNone(caches["fragments"].get(key))
+
+
+class TestTweetEntities(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.client.force_login(self.user)
+
+    def test_extract(self):
+        self.assertEqual(extract_hashtags("#Django と ＃django と #python"), ["django", "python"])
+        self.assertEqual(extract_mentions("@other さん、@other. @nobody"), ["other", "nobody"])
+
+    def test_extract_ignores_urls_and_emails(self):
+        content = "https://example.com/#anchor https://example.com/page#top test@example.com (@other) ＃タグ"
+        self.assertEqual(extract_hashtags(content), ["タグ"])
+        self.assertEqual(extract_mentions(content), ["other"])
+
+    def test_extract_ignores_too_long(self):
+        self.assertEqual(extract_hashtags(f"#{'a' * 100} #{'b' * 101}"), ["a" * 100])
+        self.assertEqual(extract_mentions(f"@{'a' * 150} @{'b' * 151}"), ["a" * 150])
+
+    def test_create_indexes_entities(self):
+        self.client.post(reverse("tweets:create"), {"content": "#Django @other @nobody"})
+        tweet = Tweet.objects.get()
+        self.assertEqual(list(TweetTag.objects.values_list("tweet", "hashtag__name")), [(tweet.id, "django")])
+        self.assertEqual(list(Mention.objects.values_list("tweet", "user")), [(tweet.id, self.other.id)])
+
+    def test_create_rolls_back_without_entities(self):
+        with mock.patch("tweets.views.index_tweet_entities", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse("tweets:create"), {"content": "#Django"})
+        self.assertFalse(Tweet.objects.exists())
+
+    def test_hashtag_view(self):
+        tweets = [Tweet.objects.create(user=self.other, content=f"#django {i}") for i in range(3)]
+        Tweet.objects.create(user=self.other, content="#python")
+        call_command("backfill_tweet_entities", chunk_size=2, stdout=StringIO())
+        with mock.patch("tweets.views.TweetEntryListView.page_size", 2):
+            response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "Django"}))
+            self.assertEqual(list(response.context["tweets"]), tweets[:0:-1])
+            response = self.client.get(
+                reverse("tweets:hashtag", kwargs={"name": "django"}), {"cursor": response.context["page"].next_cursor}
+            )
+        self.assertEqual(list(response.context["tweets"]), tweets[:1])
+        response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "nothing"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_mention_view(self):
+        tweet = Tweet.objects.create(user=self.other, content="@testuser こんにちは")
+        Tweet.objects.create(user=self.other, content="@other こんにちは")
+        call_command("backfill_tweet_entities", stdout=StringIO())
+        response = self.client.get(reverse("tweets:mentions"))
+        self.assertEqual(list(response.context["tweets"]), [tweet])
+
+
+class TestTrendingTopics(TestCase):
+    def setUp(self):
+        reset_trending()
+        self.addCleanup(reset_trending)
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+        self.now = timezone.now()
+
+    def test_sliding_windows(self):
+        trending = TrendingTopics(top_k=2, width=64, depth=4)
+        trending.add(["old"], (self.now - timedelta(hours=2)).timestamp())
+        trending.add(["hour"], (self.now - timedelta(minutes=30)).timestamp())
+        trending.add(["now", "hour"], self.now.timestamp())
+        top = trending.top(self.now)
+        self.assertEqual(top["5m"], [("hour", 1), ("now", 1)])
+        self.assertEqual(top["1h"], [("hour", 2), ("now", 1)])
+        self.assertEqual(top["24h"], [("hour", 2), ("old", 1)])
+        top = trending.top(self.now + timedelta(minutes=10))
+        self.assertEqual(top["5m"], [])
+
+    def test_top_k_is_bounded(self):
+        trending = TrendingTopics(top_k=3, width=256, depth=4)
+        for i in range(50):
+            trending.add([f"term{i}"] * (i % 5 + 1), self.now.timestamp())
+        top = trending.top(self.now)["24h"]
+        self.assertEqual(len(top), 3)
+        self.assertTrue(all(count >= 5 for _, count in top))
+
+    def test_trending_view(self):
+        rebuild_trending()
+        Tweet.objects.create(user=self.user, content="#Django と #python")
+        Tweet.objects.create(user=self.user, content="#django")
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual(response.context["trends"][0], ("5m", [("django", 2), ("python", 1)]))
+        self.assertContains(response, reverse("tweets:hashtag", kwargs={"name": "django"}))
+
+    def test_not_loaded_yet(self):
+        with mock.patch("tweets.trending.threading.Thread") as thread:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("tweets:trending"))
+                tweet = Tweet.objects.create(user=self.user, content="#django")
+            self.assertFalse(
+                any(query["sql"].startswith("SELECT") and "tweets_tweet" in query["sql"] for query in queries)
+            )
+            self.assertEqual(response.context["trends"][0], ("5m", []))
+            thread.return_value.start.assert_called_once()
+            self.client.get(reverse("tweets:trending"))
+            thread.return_value.start.assert_called_once()
+        # 組み立て中に保存されたツイートも、組み立て終わったトレンドに入る
+        with mock.patch("tweets.trending.Tweet.objects.filter", return_value=Tweet.objects.none()):
+            trending = rebuild_trending(now=tweet.created_at - timedelta(seconds=1))
+        self.assertEqual(trending.top(tweet.created_at)["5m"], [("django", 1)])
+
+    def test_rebuild_command(self):
+        Tweet.objects.create(user=self.user, content="#django")
+        out = StringIO()
+        call_command("rebuild_trending", stdout=out)
+        self.assertIn("24h: #django (1)", out.getvalue())
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        caches["last_modified"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="Test tweet")
+        self.client.force_login(self.user)
+
+    def assertNotModified(self, url, **headers):
+        with mock.patch("django.template.backends.django.Template.render") as render:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+    def test_home(self):
+        url = reverse("tweets:home")
+        etag = self.client.get(url)["ETag"]
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+        add_like(self.other, self.tweet)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.id}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        Tweet.objects.create(user=self.user, content="New tweet")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_if_modified_since(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.id})
+        last_modified = self.client.get(url)["Last-Modified"]
+        self.assertNotModified(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        add_like(self.other, self.tweet)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response["Last-Modified"]), parse_http_date(last_modified))
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": 0}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestAsyncTweetDetailView(TransactionTestCase):
+    def setUp(self):
+        caches["likes"].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="Async tweet")
+        Like.objects.create(likeuser=self.user, likedtweet=self.tweet)
+        self.view = async_to_sync(AsyncTweetDetailView.as_view())
+
+    def test_success_get(self):
+        request = RequestFactory().get(reverse("tweets:detail", kwargs={"pk": self.tweet.id}))
+        request.user = self.user
+        response = self.view(request, pk=self.tweet.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Async tweet")
+        self.assertContains(response, "いいね取り消し")
+
+    def test_failure_get_with_not_exist_tweet(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        with self.assertRaises(Http404):
+            self.view(request, pk=0)
+
+    def test_success_get_with_etag(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.id})
+
+        def get(view, **headers):
+            request = RequestFactory().get(url, **headers)
+            request.user = self.user
+            return view(request, pk=self.tweet.id)
+
+        etag = get(self.view)["ETag"]
+        # 同期版と同じ ETag を返し、一致すれば 304 を返す
+        self.assertEqual(get(TweetDetailView.as_view())["ETag"], etag)
+        self.assertEqual(get(self.view, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Tweet.objects.filter(pk=self.tweet.pk).update(version=F("version") + 1)
+        self.assertEqual(get(self.view, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_liked_ids_are_read_once(self):
+        request = RequestFactory().get(reverse("tweets:detail", kwargs={"pk": self.tweet.id}))
+        request.user = self.user
+        with mock.patch.object(liked_tweet_cache, "get", wraps=liked_tweet_cache.get) as get:
+            response = self.view(request, pk=self.tweet.id)
+        get.assert_called_once_with(self.user.id)
+        self.assertContains(response, "いいね取り消し")
+
+
+class TestLiveUpdates(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        FriendShip.objects.create(follower=self.user, followee=self.other)
+        self.tweet = Tweet.objects.create(user=self.other, content="Test tweet")
+        self.hub = LiveHub(like_interval=60, max_queue=3)
+        patcher = mock.patch("tweets.signals.live_hub", self.hub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        mock.patch("tweets.live.live_hub", self.hub).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def drain(self, subscriber):
+        events = []
+        while not subscriber.queue.empty():
+            events.append(subscriber.queue.get_nowait())
+        return events
+
+    def test_new_tweet_is_pushed_to_followers(self):
+        async def run():
+            follower = self.hub.subscribe(self.user.id)
+            stranger = self.hub.subscribe(self.user.id + 100)
+            await sync_to_async(self.create_tweet)()
+            await asyncio.sleep(0)
+            return self.drain(follower), self.drain(stranger)
+
+        follower_events, stranger_events = async_to_sync(run)()
+        tweet = Tweet.objects.latest("id")
+        self.assertEqual(follower_events, [("tweet", {"id": tweet.id, "user_id": self.other.id})])
+        self.assertEqual(stranger_events, [])
+
+    def create_tweet(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tweet.objects.create(user=self.other, content="New tweet")
+
+    def test_like_counts_are_coalesced(self):
+        async def run():
+            subscriber = self.hub.subscribe(self.user.id)
+            await sync_to_async(self.like_twice)()
+            self.hub.flush_likes()
+            await asyncio.sleep(0)
+            return self.drain(subscriber)
+
+        events = async_to_sync(run)()
+        self.assertEqual(events, [("likes", [{"tweet_id": self.tweet.id, "delta": 2, "likes_count": 2}])])
+
+    def like_twice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            add_like(self.user, self.tweet)
+            apply_like_operations(self.other.id, [(self.tweet.id, True)])
+
+    def test_slow_subscriber_gets_resync(self):
+        async def run():
+            subscriber = self.hub.subscribe(self.user.id)
+            for i in range(5):
+                self.hub.publish("tweet", {"id": i})
+            await asyncio.sleep(0)
+            return self.drain(subscriber)
+
+        self.assertEqual(async_to_sync(run)(), [("resync", {}), ("tweet", {"id": 4})])
+
+    @override_settings(LIVE_UPDATES=True)
+    def test_event_stream(self):
+        self.client.force_login(self.user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.session.session_key}".encode()
+
+        async def run(headers):
+            sent = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if message.get("body") == b"retry: 3000\n\n":
+                    self.hub.publish("tweet", {"id": 1, "user_id": self.other.id})
+                elif message.get("body", b"").startswith(b"event:"):
+                    disconnected.set()
+
+            scope = {"type": "http", "path": "/tweets/live/", "method": "GET", "headers": headers}
+            await asyncio.wait_for(live_application(scope, receive, send), 5)
+            return sent
+
+        sent = async_to_sync(run)([(b"cookie", cookie)])
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(sent[-1]["body"], b'event: tweet\ndata: {"id":1,"user_id":%d}\n\n' % self.other.id)
+        self.assertEqual(async_to_sync(run)([])[0]["status"], 403)
+
+    def test_event_stream_is_disabled(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": "/tweets/live/", "method": "GET", "headers": []}
+        async_to_sync(live_application)(scope, None, send)
+        self.assertEqual(sent[0]["status"], 404)
+        self.assertEqual(self.hub.user_ids(), set())
+
+    @override_settings(LIVE_LIKE_INTERVAL_MS=250, LIVE_QUEUE_SIZE=7)
+    def test_hub_reads_settings_when_used(self):
+        self.assertEqual(LiveHub().like_interval, 0.25)
+        self.assertEqual(LiveHub().max_queue, 7)
+
+
+class TestGenerateFakeDataCommand(TestCase):
+    def generate(self, **options):
+        options = {"users": 30, "follows": 200, "tweets": 100, "likes": 400, "seed": 1, **options}
+        call_command("generate_fake_data", stdout=StringIO(), **options)
+
+    def test_generate(self):
+        self.generate(timelines=True)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(FriendShip.objects.count(), 200)
+        self.assertEqual(Tweet.objects.count(), 100)
+        self.assertEqual(Like.objects.count(), 400)
+        self.assertFalse(FriendShip.objects.filter(follower=F("followee")).exists())
+        self.assertTrue(TimelineEntry.objects.exists())
+        # フォロー数・いいね数は生成したデータと一致している
+        out = StringIO()
+        call_command("rebuild_follow_counts", stdout=out)
+        call_command("rebuild_like_counts", stdout=out)
+        self.assertIn("0 人", out.getvalue())
+        self.assertIn("0 件", out.getvalue())
+
+    def test_created_at_is_spread(self):
+        self.generate(days=10)
+        oldest = Tweet.objects.order_by("created_at").first().created_at
+        self.assertLess(oldest, timezone.now() - timedelta(days=1))
+        self.assertLess(
+            FriendShip.objects.order_by("created_at").first().created_at, timezone.now() - timedelta(days=1)
+        )
+
+    def follow_graph(self):
+        base = User.objects.order_by("id").first().id
+        follows = FriendShip.objects.order_by("id").values_list("follower_id", "followee_id")
+        return [(follower_id - base, followee_id - base) for follower_id, followee_id in follows]
+
+    def test_same_seed_generates_same_graph(self):
+        self.generate()
+        first = self.follow_graph()
+        User.objects.all().delete()
+        self.generate()
+        self.assertEqual(self.follow_graph(), first)
+
+    def test_benchmark_views(self):
+        self.generate(timelines=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "benchmark.json"
+            # 計測のログは出さない
+            with override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1.0), self.assertNoLogs(
+                "mysite.sql_instrumentation"
+            ):
+                call_command("benchmark_views", iterations=2, warmup=0, output=str(output), stdout=StringIO())
+            report = json.loads(output.read_text())
+        [result] = report["results"]
+        self.assertEqual(result["rows"]["users"], 30)
+        self.assertEqual(
+            set(result["views"]), {"home", "profile", "tweet_detail", "like", "follower_list", "following_list"}
+        )
+        for measured in result["views"].values():
+            self.assertEqual(measured["status"], 200)
+            self.assertGreater(measured["queries"], 0)
+            self.assertLessEqual(measured["p50_ms"], measured["p95_ms"])
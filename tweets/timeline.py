@@ -0,0 +1,148 @@
+import heapq
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+
+from accounts.models import FriendShip, UserProfile
+from tweets.models import TimelineEntry, Tweet
+from tweets.pagination import NEXT, CursorPaginator
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def timeline_max_entries():
+    return getattr(settings, "TIMELINE_MAX_ENTRIES", 800)
+
+
+def fanout_follower_threshold():
+    # フォロワーがこの人数以上のユーザーのツイートは書き込み時に配らず、読み込み時にマージする
+    return getattr(settings, "TIMELINE_FANOUT_FOLLOWER_THRESHOLD", 10000)
+
+
+def _write_entries(tweets, owner_ids):
+    entries = [
+        TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at)
+        for owner_id in owner_ids
+        for tweet_id, created_at in tweets
+    ]
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True, batch_size=FANOUT_BATCH_SIZE)
+
+
+def trim_timelines(owner_ids=None):
+    """
+    TIMELINE_MAX_ENTRIES 件を超えたタイムラインだけ、古いエントリを削除する。owner_ids を省くと全員を対象にする。
+    ファンアウトでは 1 人 1 件ずつしか増えないので、書き込みのたびではなく trim_timelines コマンドで定期的に行う。
+    """
+    max_entries = timeline_max_entries()
+    entries = TimelineEntry.objects.all()
+    if owner_ids is not None:
+        entries = entries.filter(owner_id__in=owner_ids)
+    over = entries.values("owner_id").annotate(count=Count("id")).filter(count__gt=max_entries)
+    over = list(over.order_by("owner_id").values_list("owner_id", flat=True))
+    if not over:
+        return 0
+    # 各タイムラインの TIMELINE_MAX_ENTRIES 件目より古いエントリを 1 文で削除する
+    cutoff = (
+        TimelineEntry.objects.filter(owner=OuterRef("owner"))
+        .order_by("-created_at", "-tweet_id")
+        .values("created_at")[max_entries - 1 : max_entries]
+    )
+    return TimelineEntry.objects.filter(owner_id__in=over, created_at__lt=Subquery(cutoff)).delete()[0]
+
+
+def high_follower_ids(user_ids):
+    profiles = UserProfile.objects.filter(user_id__in=user_ids, followers_count__gte=fanout_follower_threshold())
+    return set(profiles.values_list("user_id", flat=True))
+
+
+def fan_out_tweet(tweet):
+    tweets = [(tweet.id, tweet.created_at)]
+    _write_entries(tweets, [tweet.user_id])
+    if high_follower_ids([tweet.user_id]):
+        return
+    follower_ids = FriendShip.objects.filter(followee_id=tweet.user_id).values_list("follower_id", flat=True)
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=FANOUT_BATCH_SIZE):
+        batch.append(follower_id)
+        if len(batch) == FANOUT_BATCH_SIZE:
+            _write_entries(tweets, batch)
+            batch = []
+    if batch:
+        _write_entries(tweets, batch)
+
+
+def backfill_timeline(follower_id, followee_id):
+    if high_follower_ids([followee_id]):
+        return
+    latest = Tweet.objects.filter(user_id=followee_id).order_by("-created_at", "-id")
+    _write_entries(list(latest.values_list("id", "created_at")[: timeline_max_entries()]), [follower_id])
+    # 1 人に最大 TIMELINE_MAX_ENTRIES 件まとめて足すので、その場で切り詰める
+    trim_timelines([follower_id])
+
+
+def purge_timeline(follower_id, followee_id):
+    TimelineEntry.objects.filter(owner_id=follower_id, tweet__user_id=followee_id).delete()
+
+
+def rebuild_timeline(user_id):
+    TimelineEntry.objects.filter(owner_id=user_id).delete()
+    followee_ids = FriendShip.objects.filter(follower_id=user_id).values_list("followee_id", flat=True)
+    followee_ids = set(followee_ids) - high_follower_ids(followee_ids)
+    latest = Tweet.objects.filter(user_id__in=[user_id, *followee_ids]).order_by("-created_at", "-id")
+    _write_entries(list(latest.values_list("id", "created_at")[: timeline_max_entries()]), [user_id])
+
+
+def _merge_sources(sources, key, direction, page_size):
+    rows = []
+    seen = set()
+    for row in heapq.merge(*sources, key=key, reverse=direction == NEXT):
+        row_id = key(row)[1]
+        if row_id in seen:
+            continue
+        seen.add(row_id)
+        rows.append(row)
+        if len(rows) > page_size:
+            break
+    return rows
+
+
+def read_home_timeline(user, cursor, page_size):
+    """
+    事前に配られたタイムラインと、フォロー中の高フォロワーユーザーの最新ツイートを
+    ヒープで k-way マージする。カーソルは Tweet の (created_at, id) なので HomeView と互換。
+    """
+    paginator = CursorPaginator(page_size)
+    direction, values = paginator.decode(cursor) if cursor else (NEXT, None)
+
+    entry_paginator = CursorPaginator(page_size, ("created_at", "tweet_id"))
+    entries = entry_paginator.apply(TimelineEntry.objects.filter(owner=user), direction, values)
+    entries = entries.select_related("tweet__user")[: page_size + 1]
+    sources = [(entry.tweet for entry in entries)]
+
+    followee_ids = FriendShip.objects.filter(follower=user).values_list("followee_id", flat=True)
+    for followee_id in high_follower_ids(followee_ids):
+        tweets = paginator.apply(Tweet.objects.filter(user_id=followee_id), direction, values)
+        sources.append(tweets.select_related("user")[: page_size + 1])
+
+    rows = _merge_sources(sources, attrgetter("created_at", "id"), direction, page_size)
+    return paginator.page(rows, direction, bool(cursor))
+
+
+def home_timeline_ids(user, cursor, page_size):
+    """
+    read_home_timeline と同じページのツイート id だけを、索引だけで読める列から求める。
+    """
+    paginator = CursorPaginator(page_size)
+    direction, values = paginator.decode(cursor) if cursor else (NEXT, None)
+
+    entry_paginator = CursorPaginator(page_size, ("created_at", "tweet_id"))
+    entries = entry_paginator.apply(TimelineEntry.objects.filter(owner=user), direction, values)
+    sources = [entries.values_list("created_at", "tweet_id")[: page_size + 1]]
+
+    followee_ids = FriendShip.objects.filter(follower=user).values_list("followee_id", flat=True)
+    for followee_id in high_follower_ids(followee_ids):
+        tweets = paginator.apply(Tweet.objects.filter(user_id=followee_id), direction, values)
+        sources.append(tweets.values_list("created_at", "id")[: page_size + 1])
+
+    return [tweet_id for _, tweet_id in _merge_sources(sources, itemgetter(0, 1), direction, page_size)]
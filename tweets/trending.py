@@ -0,0 +1,205 @@
+import hashlib
+import heapq
+import logging
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from tweets.entities import extract_hashtags
+from tweets.models import Tweet
+
+logger = logging.getLogger(__name__)
+
+# (表示名, 窓の長さ秒, バケットの幅秒)
+WINDOWS = (
+    ("5m", 5 * 60, 60),
+    ("1h", 60 * 60, 5 * 60),
+    ("24h", 24 * 60 * 60, 60 * 60),
+)
+
+
+def sketch_indexes(term, width, depth):
+    digest = hashlib.blake2b(term.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [row * width + (h1 + row * h2) % width for row in range(depth)]
+
+
+class SlidingWindow:
+    """
+    時間バケットごとの count-min sketch を環状に並べ、直近 span 秒の語の出現数を見積もる。
+    上位 top_k 件の候補だけをヒープで持つので、語の種類がいくら増えてもメモリは一定。
+    """
+
+    def __init__(self, span, bucket_span, width, depth, top_k):
+        self.bucket_span = bucket_span
+        self.size = span // bucket_span
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.tables = [array("q", bytes(8 * width * depth)) for _ in range(self.size)]
+        self.bucket_ids = [None] * self.size
+        self.head = None
+        self.candidates = {}
+        self._heap = []
+
+    def is_live(self, bucket_id):
+        return bucket_id is not None and self.head - self.size < bucket_id <= self.head
+
+    def estimate(self, indexes):
+        tables = [table for table, bucket_id in zip(self.tables, self.bucket_ids) if self.is_live(bucket_id)]
+        return min(sum(table[i] for table in tables) for i in indexes)
+
+    def advance(self, timestamp):
+        bucket_id = int(timestamp // self.bucket_span)
+        if self.head is not None and bucket_id <= self.head:
+            return
+        self.head = bucket_id
+        # 窓から外れたバケットの分を候補の見積もりから引き直す
+        candidates = {}
+        for term in self.candidates:
+            count = self.estimate(sketch_indexes(term, self.width, self.depth))
+            if count:
+                candidates[term] = count
+        self.candidates = candidates
+        self._heap = [(count, term) for term, count in candidates.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, term, timestamp, count=1):
+        self.advance(timestamp)
+        bucket_id = int(timestamp // self.bucket_span)
+        if not self.is_live(bucket_id):
+            return
+        slot = bucket_id % self.size
+        table = self.tables[slot]
+        if self.bucket_ids[slot] != bucket_id:
+            table[:] = array("q", bytes(8 * len(table)))
+            self.bucket_ids[slot] = bucket_id
+        indexes = sketch_indexes(term, self.width, self.depth)
+        for i in indexes:
+            table[i] += count
+        self._offer(term, self.estimate(indexes))
+
+    def _offer(self, term, count):
+        if term not in self.candidates and len(self.candidates) >= self.top_k:
+            # ヒープには古い見積もりも残っているので、候補と一致するものが出るまで捨てる
+            while self._heap and self.candidates.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if count <= self._heap[0][0]:
+                return
+            _, evicted = heapq.heappop(self._heap)
+            del self.candidates[evicted]
+        self.candidates[term] = count
+        heapq.heappush(self._heap, (count, term))
+        if len(self._heap) > 4 * self.top_k:
+            self._heap = [(count, term) for term, count in self.candidates.items()]
+            heapq.heapify(self._heap)
+
+    def top(self):
+        return sorted(self.candidates.items(), key=lambda item: (-item[1], item[0]))
+
+
+class TrendingTopics:
+    def __init__(self, top_k=10, width=2048, depth=4):
+        self.windows = {
+            name: SlidingWindow(span, bucket_span, width, depth, top_k) for name, span, bucket_span in WINDOWS
+        }
+        self._lock = threading.Lock()
+
+    def add(self, terms, timestamp):
+        with self._lock:
+            for window in self.windows.values():
+                for term in terms:
+                    window.add(term, timestamp)
+
+    def add_tweet(self, tweet):
+        self.add(extract_hashtags(tweet.content), tweet.created_at.timestamp())
+
+    def top(self, now=None):
+        now = timezone.now() if now is None else now
+        with self._lock:
+            for window in self.windows.values():
+                window.advance(now.timestamp())
+            return {name: window.top() for name, window in self.windows.items()}
+
+
+_trending = None
+# 組み立て中に保存されたツイートの (ハッシュタグ, 投稿時刻)。組み立てていないときは None
+_recorded_while_loading = None
+_trending_lock = threading.Lock()
+
+
+def rebuild_trending(now=None):
+    """
+    直近 24 時間のツイートを古い順に流し込んでトレンドを組み立て直す。
+    状態はプロセスごとに持つので、組み立て直されるのは呼び出したプロセスのトレンドだけ。
+    """
+    global _trending, _recorded_while_loading
+    now = timezone.now() if now is None else now
+    with _trending_lock:
+        if _recorded_while_loading is None:
+            _recorded_while_loading = []
+    trending = TrendingTopics(
+        top_k=settings.TRENDING_TOP_K,
+        width=settings.TRENDING_SKETCH_WIDTH,
+        depth=settings.TRENDING_SKETCH_DEPTH,
+    )
+    try:
+        since = now - timedelta(seconds=max(span for _, span, _ in WINDOWS))
+        tweets = Tweet.objects.filter(created_at__gt=since, created_at__lte=now).order_by("created_at", "id")
+        for tweet in tweets.only("content", "created_at").iterator():
+            trending.add_tweet(tweet)
+    finally:
+        with _trending_lock:
+            recorded, _recorded_while_loading = _recorded_while_loading, None
+    # 読み込んだ範囲より後に保存されたツイートは、組み立て中に記録しておいた分から足す
+    for terms, timestamp in recorded or []:
+        if timestamp > now.timestamp():
+            trending.add(terms, timestamp)
+    with _trending_lock:
+        _trending = trending
+    return trending
+
+
+def _load_trending():
+    try:
+        rebuild_trending()
+    except Exception:
+        logger.exception("トレンドを組み立てられませんでした。")
+    finally:
+        connections.close_all()
+
+
+def get_trending():
+    """
+    プロセス内のトレンドを返す。まだ組み立てていなければバックグラウンドで組み立て始めて None を返す。
+    """
+    global _recorded_while_loading
+    with _trending_lock:
+        if _trending is not None or _recorded_while_loading is not None:
+            return _trending
+        _recorded_while_loading = []
+    threading.Thread(target=_load_trending, name="trending-loader", daemon=True).start()
+    return None
+
+
+def reset_trending():
+    global _trending, _recorded_while_loading
+    with _trending_lock:
+        _trending = None
+        _recorded_while_loading = None
+
+
+def record_tweet(tweet):
+    # 組み立てる前のツイートは組み立てるときに DB から読み込まれるので、ここでは何もしない
+    with _trending_lock:
+        trending = _trending
+        if trending is None:
+            if _recorded_while_loading is not None:
+                _recorded_while_loading.append((extract_hashtags(tweet.content), tweet.created_at.timestamp()))
+            return
+    trending.add_tweet(tweet)
@@ -1,14 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+TweetDetailView = views.AsyncTweetDetailView if settings.ASYNC_VIEWS else views.TweetDetailView
+
 app_name = "tweets"
 
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
+    path("search/", views.TweetSearchView.as_view(), name="search"),
+    path("tags/<str:name>/", views.HashtagView.as_view(), name="hashtag"),
+    path("mentions/", views.MentionListView.as_view(), name="mentions"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
-    path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
+    path("<int:pk>/", TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("likes/batch/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("cache/liked/stats/", views.LikedTweetCacheStatsView.as_view(), name="liked_cache_stats"),
 ]
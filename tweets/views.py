@@ -1,21 +1,115 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, reverse_lazy
-from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
-
-from tweets.models import Like, Tweet
-
-
-class HomeView(LoginRequiredMixin, ListView):
+from django.views.generic import CreateView, DeleteView, DetailView, ListView, TemplateView, View
+
+from mysite.async_db import gather_reads
+from mysite.db_router import AsyncReplicaReadMixin, ReplicaReadMixin
+from tweets.cache import liked_tweet_cache
+from tweets.conditional import AsyncConditionalGetMixin, ConditionalGetMixin, like_set_version, tweet_versions
+from tweets.entities import index_tweet_entities
+from tweets.likes import set_like, set_likes, with_liked_state
+from tweets.models import Hashtag, Mention, Tweet, TweetTag
+from tweets.pagination import CursorPaginationMixin, paginate_tweet_entries
+from tweets.search import search_tweets
+from tweets.streaming import StreamingTemplateMixin
+from tweets.timeline import home_timeline_ids, read_home_timeline
+from tweets.trending import WINDOWS, get_trending
+
+
+class HomeView(
+    LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, CursorPaginationMixin, StreamingTemplateMixin, ListView
+):
     template_name = "tweets/home.html"
     model = Tweet
     context_object_name = "tweets"
-    queryset = Tweet.objects.select_related("user")
+    stream_row_template_name = "tweets/tweet_row.html"
+    stream_row_context_name = "tweet"
+
+    def get_validator_parts(self):
+        tweet_ids = home_timeline_ids(self.request.user, self.get_cursor(), self.page_size)
+        return [tweet_versions(tweet_ids), like_set_version(self.request.user.id)]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["live_updates"] = getattr(settings, "LIVE_UPDATES", False)
+        return context
+
+    def paginate_by_cursor(self, queryset):
+        page = read_home_timeline(self.request.user, self.get_cursor(), self.page_size)
+        page.object_list = with_liked_state(page.object_list, self.request.user)
+        return page
+
+
+class TweetSearchView(LoginRequiredMixin, ReplicaReadMixin, TemplateView):
+    template_name = "tweets/search.html"
+    page_size = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        q = self.request.GET.get("q", "").strip()
+        if q:
+            page = search_tweets(q, self.request.GET.get("cursor"), self.page_size)
+            page.object_list = with_liked_state(page.object_list, self.request.user)
+            context["page"] = page
+            context["tweets"] = page.object_list
+        context["q"] = q
+        return context
+
+
+class TweetEntryListView(LoginRequiredMixin, ReplicaReadMixin, TemplateView):
+    """
+    ハッシュタグ・メンションの索引テーブルから (created_at, tweet) の降順でツイートを読む。
+    """
+
+    template_name = "tweets/tweet_list.html"
+    page_size = 20
+
+    def get_entries(self):
+        raise NotImplementedError
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = paginate_tweet_entries(self.get_entries(), self.request.GET.get("cursor"), self.page_size)
+        page.object_list = with_liked_state(page.object_list, self.request.user)
+        context["page"] = page
+        context["tweets"] = page.object_list
+        return context
+
+
+class HashtagView(TweetEntryListView):
+    def get_entries(self):
+        self.hashtag = get_object_or_404(Hashtag, name=self.kwargs["name"].casefold())
+        return TweetTag.objects.filter(hashtag=self.hashtag)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like_list"] = Like.objects.filter(likeuser=self.request.user).values_list("likedtweet__pk", flat=True)
+        context["title"] = str(self.hashtag)
+        return context
+
+
+class MentionListView(TweetEntryListView):
+    extra_context = {"title": "あなた宛てのツイート"}
+
+    def get_entries(self):
+        return Mention.objects.filter(user=self.request.user)
+
+
+class TrendingView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/trending.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        trending = get_trending()
+        # 起動直後で組み立て中のときは空のトレンドを出す
+        top = trending.top() if trending is not None else {}
+        context["trends"] = [(name, top.get(name, [])) for name, _, _ in WINDOWS]
         return context
 
 
@@ -27,18 +121,49 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        # ツイートだけが保存されてハッシュタグ・メンションが欠けることのないよう、同じトランザクションで書き込む
+        with transaction.atomic():
+            response = super().form_valid(form)
+            index_tweet_entities([self.object])
+        return response
+
+
+def tweet_detail_validator_parts(viewer, pk):
+    version = Tweet.objects.filter(pk=pk).values_list("version", flat=True).first()
+    if version is None:
+        raise Http404("ツイートが見つかりません。")
+    return [pk, version, like_set_version(viewer.id)]
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, DetailView):
     model = Tweet
     template_name = "tweets/tweet_detail.html"
-    queryset = Tweet.objects.select_related("user").prefetch_related("likedtweet")
+    queryset = Tweet.objects.select_related("user")
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["like_list"] = Like.objects.filter(likeuser=self.request.user).values_list("likedtweet__pk", flat=True)
-        return context
+    def get_validator_parts(self):
+        return tweet_detail_validator_parts(self.request.user, self.kwargs["pk"])
+
+    def get_object(self, queryset=None):
+        return with_liked_state([super().get_object(queryset)], self.request.user)[0]
+
+
+class AsyncTweetDetailView(AsyncReplicaReadMixin, AsyncConditionalGetMixin, View):
+    template_name = "tweets/tweet_detail.html"
+
+    def get_validator_parts(self):
+        return tweet_detail_validator_parts(self.request.user, self.kwargs["pk"])
+
+    async def get_page(self, request, pk):
+        viewer = request.user
+        # ツイートの読み込みと、いいね済み id のキャッシュの読み込み (ミス時は DB) を並行に行う
+        tweet, liked_ids = await gather_reads(
+            lambda: Tweet.objects.select_related("user").filter(pk=pk).first(),
+            lambda: liked_tweet_cache.get(viewer.id),
+        )
+        if tweet is None:
+            raise Http404("ツイートが見つかりません。")
+        tweet = (await sync_to_async(with_liked_state)([tweet], viewer, liked_ids))[0]
+        return await sync_to_async(render)(request, self.template_name, {"tweet": tweet, "object": tweet})
 
 
 class TweetDeleteView(UserPassesTestMixin, DeleteView):
@@ -55,13 +180,13 @@ class LikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         tweet_id = kwargs["pk"]
         tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
-        Like.objects.get_or_create(likeuser=request.user, likedtweet=tweet)
+        likes_count = set_like(request.user, tweet, True)
         liked = True
         unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
         context = {
             "liked": liked,
             "tweet_id": tweet_id,
-            "likes_count": tweet.likedtweet.count(),
+            "likes_count": likes_count,
             "unlike_url": unlike_url,
         }
         return JsonResponse(context)
@@ -71,13 +196,47 @@ class UnlikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         tweet_id = kwargs["pk"]
         tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
-        Like.objects.filter(likeuser=request.user, likedtweet=tweet).delete()
+        likes_count = set_like(request.user, tweet, False)
         liked = False
         like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
         context = {
             "liked": liked,
             "tweet_id": tweet_id,
-            "likes_count": tweet.likedtweet.count(),
+            "likes_count": likes_count,
             "like_url": like_url,
         }
         return JsonResponse(context)
+
+
+class LikeBatchView(LoginRequiredMixin, View):
+    max_operations = 100
+    # Tweet の id (BigAutoField) に入る範囲。範囲外の値はデータベースに渡すと OverflowError になる
+    max_tweet_id = 2**63 - 1
+
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = [
+                (int(operation["tweet_id"]), {"like": True, "unlike": False}[operation["action"]])
+                for operation in json.loads(request.body)["operations"]
+            ]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "不正なリクエストです。"}, status=400)
+        if not all(0 < tweet_id <= self.max_tweet_id for tweet_id, _ in operations):
+            return JsonResponse({"error": "不正なリクエストです。"}, status=400)
+        if len(operations) > self.max_operations:
+            return JsonResponse({"error": f"一度に送れる操作は {self.max_operations} 件までです。"}, status=400)
+        likes_counts = set_likes(request.user.id, operations)
+        liked = dict(operations)
+        results = [
+            {"tweet_id": tweet_id, "liked": liked[tweet_id], "likes_count": likes_count}
+            for tweet_id, likes_count in likes_counts.items()
+        ]
+        return JsonResponse({"results": results})
+
+
+class LikedTweetCacheStatsView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(liked_tweet_cache.stats())
@@ -0,0 +1,262 @@
+import atexit
+import json
+import logging
+import os
+import secrets
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connections, transaction
+
+from tweets.models import Like
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_NAME = "dead_letter.jsonl"
+
+
+def _try_lock(file):
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _open_locked(path):
+    """
+    一時ファイルをロックしてから path に rename する。
+    ロックはファイルの実体に付くので、他のプロセスからロックされていない path が見えることはない。
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    journal = open(tmp_path, "w", encoding="utf-8")
+    fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+    return journal, tmp_path
+
+
+def _read_events(path):
+    events = {}
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                user_id, tweet_id, liked = json.loads(line)
+            except ValueError:
+                # 書き込み途中で落ちた最終行は応答前なので捨ててよい
+                continue
+            events[user_id, tweet_id] = bool(liked)
+    return events
+
+
+class LikeBuffer:
+    """
+    いいね・いいね取り消しをプロセス内に溜め、(user, tweet) ごとにまとめて定期的に 1 トランザクションで書き込む。
+    受け付けたイベントはプロセスごとのジャーナルファイルに追記してから応答する。
+    ジャーナルは持ち主のプロセスが生きている間ロックされており、起動時にロックの外れた
+    (持ち主が落ちた) ジャーナルを引き取って再生する。
+    """
+
+    def __init__(self, journal_dir, apply, flush_interval=0.2, max_events=500):
+        self.journal_dir = Path(journal_dir)
+        self.journal_path = self.journal_dir / f"{os.getpid()}-{secrets.token_hex(4)}.jsonl"
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        # (user_id, tweet_id) -> (liked, was_liked)。was_liked は書き込み前の DB 上の状態
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._journal = None
+        self._thread = None
+
+    def start(self, background=True):
+        if fcntl is None:
+            raise ImproperlyConfigured("LIKE_WRITE_BEHIND はファイルロック (fcntl) が使える環境でのみ有効にできます。")
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self._rewrite_journal()
+        self._claim_orphans()
+        atexit.register(self.close)
+        if background:
+            self._thread = threading.Thread(target=self._run, name="like-write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self.flush()
+        if self._journal is not None:
+            with self._lock:
+                if not self._pending:
+                    self.journal_path.unlink(missing_ok=True)
+            self._journal.close()
+            self._journal = None
+
+    def _db_liked(self, user_id, tweet_id):
+        return Like.objects.filter(likeuser_id=user_id, likedtweet_id=tweet_id).exists()
+
+    def _claim_orphans(self):
+        paths = [
+            path
+            for path in self.journal_dir.glob("*.jsonl")
+            if path.name != DEAD_LETTER_NAME and path != self.journal_path
+        ]
+        for path in sorted(paths):
+            try:
+                orphan = open(path, encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with orphan:
+                if not _try_lock(orphan):
+                    continue
+                # 開いてからロックするまでの間に他のプロセスが引き取って消したジャーナルは読まない
+                try:
+                    claimed = os.stat(path).st_ino == os.fstat(orphan.fileno()).st_ino
+                except FileNotFoundError:
+                    claimed = False
+                if not claimed:
+                    continue
+                events = _read_events(path)
+                with self._lock:
+                    for (user_id, tweet_id), liked in events.items():
+                        was_liked = self._pending.get((user_id, tweet_id), (None, None))[1]
+                        if was_liked is None:
+                            was_liked = self._db_liked(user_id, tweet_id)
+                        self._pending[user_id, tweet_id] = (liked, was_liked)
+                    self._rewrite_journal()
+                path.unlink()
+                logger.info("%s から %d 件のいいねを引き取りました。", path.name, len(events))
+
+    def _append(self, user_id, tweet_id, liked):
+        self._journal.write(json.dumps([user_id, tweet_id, int(liked)]) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self):
+        journal, tmp_path = _open_locked(self.journal_path)
+        for (user_id, tweet_id), (liked, _) in self._pending.items():
+            journal.write(json.dumps([user_id, tweet_id, int(liked)]) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+        os.replace(tmp_path, self.journal_path)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = journal
+
+    def _dead_letter(self, operations):
+        with open(self.journal_dir / DEAD_LETTER_NAME, "a", encoding="utf-8") as dead_letter:
+            for user_id, user_operations in operations.items():
+                for tweet_id, liked in user_operations:
+                    dead_letter.write(json.dumps([user_id, tweet_id, int(liked)]) + "\n")
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+
+    def enqueue(self, user_id, tweet_id, liked):
+        key = (user_id, tweet_id)
+        with self._lock:
+            if key in self._pending:
+                was_liked = self._pending[key][1]
+            elif key in self._flushing:
+                was_liked = self._flushing[key][0]
+            else:
+                was_liked = None
+        if was_liked is None:
+            was_liked = self._db_liked(user_id, tweet_id)
+        with self._lock:
+            self._append(user_id, tweet_id, liked)
+            self._pending[key] = (liked, self._pending.get(key, (None, was_liked))[1])
+            full = len(self._pending) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def liked_overlay(self, user_id):
+        with self._lock:
+            overlay = {}
+            for events in (self._flushing, self._pending):
+                overlay.update({tweet_id: liked for (uid, tweet_id), (liked, _) in events.items() if uid == user_id})
+        return overlay
+
+    def count_deltas(self, tweet_ids):
+        tweet_ids = set(tweet_ids)
+        deltas = defaultdict(int)
+        with self._lock:
+            for events in (self._flushing, self._pending):
+                for (_, tweet_id), (liked, was_liked) in events.items():
+                    if tweet_id in tweet_ids:
+                        deltas[tweet_id] += int(liked) - int(was_liked)
+        return deltas
+
+    def _restore(self, user_ids):
+        with self._lock:
+            for key, (liked, was_liked) in self._flushing.items():
+                if key[0] not in user_ids:
+                    continue
+                if key in self._pending:
+                    self._pending[key] = (self._pending[key][0], was_liked)
+                else:
+                    self._pending[key] = (liked, was_liked)
+
+    def _apply_each(self, operations):
+        """
+        まとめて書き込めなかったときにユーザーごとのトランザクションで書き込み直す。
+        制約違反 (ユーザーが削除された等) で二度と書き込めないユーザーの分は dead letter に移す。
+        """
+        remaining = set(operations)
+        dead = {}
+        for user_id, user_operations in operations.items():
+            try:
+                with transaction.atomic():
+                    self.apply(user_id, user_operations)
+            except IntegrityError:
+                logger.warning(
+                    "ユーザー %s のいいねを書き込めないため dead letter に移します。", user_id, exc_info=True
+                )
+                dead[user_id] = user_operations
+            except Exception:
+                self._restore(remaining)
+                raise
+            remaining.discard(user_id)
+        if dead:
+            self._dead_letter(dead)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            operations = defaultdict(list)
+            for (user_id, tweet_id), (liked, _) in self._flushing.items():
+                operations[user_id].append((tweet_id, liked))
+            try:
+                try:
+                    with transaction.atomic():
+                        for user_id, user_operations in operations.items():
+                            self.apply(user_id, user_operations)
+                except IntegrityError:
+                    self._apply_each(operations)
+                except Exception:
+                    self._restore(set(operations))
+                    raise
+            finally:
+                with self._lock:
+                    flushed = len(self._flushing)
+                    self._flushing = {}
+                    self._rewrite_journal()
+            return flushed
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("いいねの書き込みに失敗しました。次回のフラッシュで再試行します。")
+            finally:
+                connections.close_all()